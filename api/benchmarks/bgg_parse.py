@@ -0,0 +1,92 @@
+'''
+Compares the streaming BGG parser with the previous xmltodict + JSON round
+trip on recorded thing XML.
+
+    python -m api.benchmarks.bgg_parse [--batch 20] [--repeat 50]
+'''
+import argparse
+import decimal
+import json
+import re
+import timeit
+import tracemalloc
+from pathlib import Path
+import xmltodict
+from api.bgg import iter_things
+
+FIXTURE = Path(__file__).resolve().parent / 'fixtures' / 'thing_stats.xml'
+
+
+def legacy_parse(xml):
+    '''
+    The parsing path used before iter_things: xmltodict, a JSON round trip to
+    drop the OrderedDicts, then picking out the fields.
+    '''
+
+    ordered_dict = xmltodict.parse(xml)
+    game_dict_nest = json.loads(json.dumps(ordered_dict))
+    items = game_dict_nest['items']['item']
+    if isinstance(items, dict):
+        items = [items]
+    games = []
+    for game_dict in items:
+        names = game_dict['name']
+        if isinstance(names, dict):
+            names = [names]
+        games.append({
+            'title': [name['@value'] for name in names if name['@type'] == 'primary'][0],
+            'bgg': int(game_dict['@id']),
+            'image': game_dict['image'],
+            'pub_year': int(game_dict['yearpublished']['@value']),
+            'min_players': int(game_dict['minplayers']['@value']),
+            'max_players': int(game_dict['maxplayers']['@value']),
+            'playtime': int(game_dict['playingtime']['@value']),
+            'player_age': int(game_dict['minage']['@value']),
+            'weight': decimal.Decimal(game_dict['statistics']['ratings']['averageweight']['@value']),
+            'categories': [link['@value'] for link in game_dict['link'] if link['@type'] == 'boardgamecategory'],
+        })
+    return games
+
+
+def streaming_parse(xml):
+    return list(iter_things(xml))
+
+
+def build_batch(size):
+    '''
+    Repeats the items of the fixture until the response holds size items,
+    like a multi-ID thing request would.
+    '''
+
+    xml = FIXTURE.read_text()
+    items = re.findall(r'\t<item .*?\n\t</item>', xml, re.S)
+    body = '\n'.join(items[index % len(items)] for index in range(size))
+    return f'<?xml version="1.0" encoding="utf-8"?>\n<items termsofuse="https://boardgamegeek.com/xmlapi/termsofuse">\n{body}\n</items>\n'.encode('utf-8')
+
+
+def peak_memory(func, xml):
+    tracemalloc.start()
+    func(xml)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batch', type=int, default=20, help='items per response')
+    parser.add_argument('--repeat', type=int, default=50, help='parses per measurement')
+    args = parser.parse_args()
+
+    xml = build_batch(args.batch)
+    legacy, streaming = legacy_parse(xml), streaming_parse(xml)
+    assert legacy == [{key: game[key] for key in legacy[0]} for game in streaming], 'parsers disagree'
+
+    print(f'{args.batch} items, {len(xml) / 1024:.0f} KiB per response, {args.repeat} parses')
+    for name, func in (('xmltodict + json', legacy_parse), ('iter_things', streaming_parse)):
+        seconds = min(timeit.repeat(lambda: func(xml), number=args.repeat, repeat=3))
+        print(f'{name:>18}: {seconds / args.repeat * 1000:8.2f} ms/parse, peak {peak_memory(func, xml) / 1024:8.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+import io
+import logging
+import time
+import decimal
+import requests
+from xml.etree import ElementTree
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from .ratelimit import RateLimited, bgg_limiter
+
+logger = logging.getLogger(__name__)
+
+# BGG answers 202 while it queues a request and 429 when we are going too fast
+RETRY_STATUSES = (202, 429, 500, 502, 503, 504)
+
+
+class BGGError(Exception):
+    pass
+
+
+class BGGNotFound(BGGError):
+    pass
+
+
+class BGGClient:
+    '''
+    Client for the BGG XML API2, courtesy of Board Game Geek. Requests share a
+    pooled keep-alive session, use connect/read timeouts and are retried with
+    exponential backoff while BGG is queueing or throttling them. Every
+    attempt first takes a token from the limiter, if there is one.
+    '''
+
+    def __init__(self, base_url=None, timeout=None, max_retries=None, backoff=None, max_delay=None, session=None, limiter=None):
+        self.base_url = (base_url or settings.BGG_BASE_URL).rstrip('/')
+        self.timeout = timeout or (settings.BGG_CONNECT_TIMEOUT, settings.BGG_READ_TIMEOUT)
+        self.max_retries = settings.BGG_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.BGG_RETRY_BACKOFF if backoff is None else backoff
+        self.max_delay = settings.BGG_MAX_RETRY_DELAY if max_delay is None else max_delay
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.BGG_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.limiter = limiter
+        self.metrics = {
+            'calls': 0,
+            'retries': 0,
+            'failures': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+        }
+
+    def __repr__(self):
+        return f"<BGGClient base_url:{self.base_url}>"
+
+    def get(self, path, params=None, max_retries=None):
+        '''
+        Sends a GET request to the given path and returns the response,
+        retrying queued, throttled and failed requests up to max_retries
+        times (the client's max_retries by default).
+        '''
+
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        if max_retries is None:
+            max_retries = self.max_retries
+        for attempt in range(max_retries + 1):
+            response = None
+            if self.limiter is not None:
+                try:
+                    self.limiter.acquire()
+                except RateLimited as error:
+                    self.metrics['failures'] += 1
+                    raise BGGError(f"GET {url} not sent: {error}")
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as error:
+                self.record_call(url, time.monotonic() - start, None)
+                problem = f"failed ({error})"
+            else:
+                self.record_call(url, time.monotonic() - start, response.status_code)
+                if response.status_code not in RETRY_STATUSES:
+                    if not response.ok:
+                        self.metrics['failures'] += 1
+                        raise BGGError(f"GET {url} returned {response.status_code}")
+                    return response
+                problem = f"returned {response.status_code}"
+            if attempt < max_retries:
+                self.metrics['retries'] += 1
+                time.sleep(self.retry_delay(attempt, response))
+        self.metrics['failures'] += 1
+        raise BGGError(f"GET {url} {problem} after {max_retries} retries")
+
+    def retry_delay(self, attempt, response=None):
+        '''
+        Honours Retry-After when BGG sends it, otherwise backs off
+        exponentially. Either way a single wait is capped at max_delay, so a
+        long Retry-After can't hold a worker for minutes.
+        '''
+
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            delay = int(response.headers['Retry-After'])
+        else:
+            delay = self.backoff * 2 ** attempt
+        return min(delay, self.max_delay)
+
+    def record_call(self, url, latency, status_code):
+        self.metrics['calls'] += 1
+        self.metrics['total_latency'] += latency
+        self.metrics['max_latency'] = max(self.metrics['max_latency'], latency)
+        logger.info('BGG GET %s -> %s in %.3fs', url, status_code, latency)
+
+    def thing(self, bgg, stats=True):
+        '''
+        Returns the raw XML (as bytes) for the thing with the given BGG ID.
+        '''
+
+        params = {'id': bgg}
+        if stats:
+            params['stats'] = 1
+        return self.get('xmlapi2/thing', params=params).content
+
+    def things(self, bgg_ids, stats=True):
+        '''
+        Returns the raw XML for several things at once. BGG caps the number
+        of IDs per request, see BGG_BATCH_SIZE.
+        '''
+
+        return self.thing(','.join(str(bgg) for bgg in bgg_ids), stats=stats)
+
+    def collection(self, username, wishlist=False):
+        '''
+        Returns the raw XML of a user's owned (or wishlisted) board games. BGG
+        answers 202 until the collection is ready, which can take a while for
+        large collections, so it is retried up to BGG_COLLECTION_MAX_RETRIES
+        times.
+        '''
+
+        # BGG lists expansions under the boardgame subtype as well
+        params = {'username': username, 'subtype': 'boardgame', 'excludesubtype': 'boardgameexpansion'}
+        if wishlist:
+            params['wishlist'] = 1
+        else:
+            params['own'] = 1
+        return self.get('xmlapi2/collection', params=params, max_retries=settings.BGG_COLLECTION_MAX_RETRIES).content
+
+
+_client = None
+
+
+def get_client():
+    '''
+    Returns the process-wide BGG client, creating it on first use.
+    '''
+
+    global _client
+    if _client is None:
+        _client = BGGClient(limiter=bgg_limiter())
+    return _client
+
+
+# the Game fields filled from a BGG thing item
+THING_FIELDS = (
+    'title',
+    'bgg',
+    'image',
+    'pub_year',
+    'min_players',
+    'max_players',
+    'playtime',
+    'player_age',
+    'weight',
+)
+
+# direct children of <item> whose value attribute maps onto a Game field
+VALUE_FIELDS = {
+    'yearpublished': 'pub_year',
+    'minplayers': 'min_players',
+    'maxplayers': 'max_players',
+    'playingtime': 'playtime',
+    'minage': 'player_age',
+}
+
+
+def iter_things(xml):
+    '''
+    Incrementally parses a BGG thing response and yields one dictionary per
+    item, holding the THING_FIELDS plus the item's category names. Elements
+    are discarded as soon as they have been read, so only one item is held in
+    memory at a time.
+    '''
+
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    depth = 0
+    item = None
+    item_depth = None
+    root = None
+    for event, elem in ElementTree.iterparse(io.BytesIO(xml), events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = elem
+            elif elem.tag == 'item' and item is None:
+                item = {'bgg': int(elem.get('id')), 'categories': [], 'image': None, 'weight': None}
+                item_depth = depth
+                names = []
+            continue
+        if item is not None and depth == item_depth + 1:
+            if elem.tag == 'name':
+                names.append((elem.get('type'), elem.get('value')))
+            elif elem.tag == 'image':
+                item['image'] = (elem.text or '').strip() or None
+            elif elem.tag in VALUE_FIELDS:
+                item[VALUE_FIELDS[elem.tag]] = int(elem.get('value'))
+            elif elem.tag == 'link' and elem.get('type') == 'boardgamecategory':
+                item['categories'].append(elem.get('value'))
+        elif item is not None and elem.tag == 'averageweight':
+            item['weight'] = decimal.Decimal(elem.get('value'))
+        elif item is not None and depth == item_depth:
+            item['title'] = get_primary_name(names)
+            yield item
+            item = None
+            root.clear()
+        depth -= 1
+
+
+def get_primary_name(names_list):
+    '''
+    Returns the English name of the specified board game from a list of
+    (type, value) pairs
+    '''
+
+    for name_type, value in names_list:
+        if name_type == 'primary':
+            return value
+    if len(names_list) > 0:
+        return names_list[0][1]
+
+
+def split_things(xml):
+    '''
+    Yields a (BGG ID, raw <item> XML) pair for every item of a thing response.
+    '''
+
+    depth = 0
+    for event, elem in ElementTree.iterparse(io.BytesIO(xml), events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            continue
+        if depth == 2 and elem.tag == 'item':
+            yield int(elem.get('id')), ElementTree.tostring(elem)
+            elem.clear()
+        depth -= 1
+
+
+def join_things(item_xmls):
+    return b'<items>' + b''.join(item_xmls) + b'</items>'
+
+
+def get_collection_ids(username, wishlist=False):
+    '''
+    Returns the BGG IDs in a user's owned (or wishlisted) collection.
+    '''
+
+    bgg_ids = []
+    for event, elem in ElementTree.iterparse(io.BytesIO(get_client().collection(username, wishlist))):
+        if elem.tag == 'item':
+            bgg_ids.append(int(elem.get('objectid')))
+            elem.clear()
+        elif elem.tag == 'message':
+            raise BGGNotFound(f"BGG collection of {username}: {elem.text}")
+    return list(dict.fromkeys(bgg_ids))
+
+
+def get_thing(bgg, refresh=False):
+    '''
+    Returns the item of the thing with the given BGG ID as a dictionary.
+    '''
+
+    for item in get_things([bgg], refresh=refresh):
+        return item
+    raise BGGNotFound(f"BGG has no thing with ID {bgg}")
+
+
+def get_things(bgg_ids, refresh=False):
+    '''
+    Returns the items of several things as a list of dictionaries, in the
+    order of the given IDs. IDs that BGG doesn't know are left out.
+
+    Items are read from the BGGThing cache while they are younger than
+    BGG_CACHE_TTL; the rest are fetched in multi-ID batches and cached. If
+    BGG can't be reached, expired cache entries are used instead. Pass
+    refresh=True to skip the cache; BGGError is then raised rather than
+    falling back to expired entries.
+    '''
+
+    from .models import BGGThing
+
+    bgg_ids = list(dict.fromkeys(int(bgg) for bgg in bgg_ids))
+    found = {} if refresh else BGGThing.objects.lookup(bgg_ids, max_age=settings.BGG_CACHE_TTL)
+    missing = [bgg for bgg in bgg_ids if bgg not in found]
+    batch_size = settings.BGG_BATCH_SIZE
+    for index in range(0, len(missing), batch_size):
+        batch = missing[index:index + batch_size]
+        try:
+            fetched = dict(split_things(get_client().things(batch)))
+        except BGGError:
+            if refresh:
+                raise
+            stale = BGGThing.objects.lookup(batch)
+            if len(stale) == 0:
+                raise
+            logger.warning('BGG unavailable, serving %s expired cache entries', len(stale))
+            found.update(stale)
+            continue
+        BGGThing.objects.store(fetched)
+        found.update(fetched)
+    return list(iter_things(join_things(found[bgg] for bgg in bgg_ids if bgg in found)))
+
+
+def parse_game_fields(game_dict):
+    '''
+    Returns the Game field values held in the given item dictionary.
+    '''
+
+    return {field: game_dict.get(field) for field in THING_FIELDS}
+
+
+def parse_category_names(game_dict):
+    '''
+    Returns the names of the categories linked from the given item dictionary.
+    '''
+
+    return game_dict['categories']
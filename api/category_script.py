@@ -1,9 +1,8 @@
-import requests
 from bs4 import BeautifulSoup
 from .models import Category
+from .bgg import get_client
 
-url = 'https://boardgamegeek.com/browse/boardgamecategory'
-html_text = requests.get(url).text
+html_text = get_client().get('browse/boardgamecategory').text
 soup = BeautifulSoup(html_text, 'html.parser')
 categories = soup.find_all('td')
 
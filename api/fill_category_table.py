@@ -1,11 +1,10 @@
-import requests
 from bs4 import BeautifulSoup
 from api.models import Category
+from api.bgg import get_client
 
 
 def fill_cat_table():
-    url = 'https://boardgamegeek.com/browse/boardgamecategory'
-    html_text = requests.get(url).text
+    html_text = get_client().get('browse/boardgamecategory').text
     soup = BeautifulSoup(html_text, 'html.parser')
     categories = soup.find_all('td')
 
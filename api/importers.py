@@ -0,0 +1,403 @@
+import logging
+from decimal import Decimal
+from pathlib import Path
+from uuid import uuid4
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from redis.exceptions import LockError
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Game, Category, UserStats
+from .bgg import BGGError, get_thing, get_things, get_collection_ids, parse_game_fields, parse_category_names
+from .redis_client import get_redis
+from .tasks import import_game
+
+logger = logging.getLogger(__name__)
+
+# Redis key holding the task ID of an in-flight import for a BGG ID
+IMPORT_KEY = 'bgg-import:{}'
+# seconds a failed import is reported before it can be retried
+FAILED_IMPORT_TTL = 30
+# Redis lock serialising game creation for a BGG ID across processes
+CREATE_LOCK_KEY = 'bgg-create:{}'
+CREATE_LOCK_TIMEOUT = 60
+
+# Game fields that are refreshed from BGG (bgg itself is the lookup key)
+GAME_FIELDS = (
+    'title',
+    'image',
+    'pub_year',
+    'min_players',
+    'max_players',
+    'playtime',
+    'player_age',
+    'weight',
+)
+
+
+def chunked(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def new_game(bgg):
+    '''
+    Takes a BGG ID and returns the associated game object using the BGG XML
+    API2, courtesy of Board Game Geek.
+
+    Creation holds a Redis lock for the BGG ID, so only one process fetches
+    it from BGG while the others wait and pick up its game. If the lock
+    can't be taken in time, the unique bgg column still keeps a single row.
+    '''
+
+    lock = get_redis().lock(CREATE_LOCK_KEY.format(bgg), timeout=CREATE_LOCK_TIMEOUT, blocking_timeout=CREATE_LOCK_TIMEOUT)
+    try:
+        locked = lock.acquire()
+    except LockError:
+        locked = False
+    if not locked:
+        logger.warning('Creating game %s without the creation lock', bgg)
+    try:
+        game_obj = Game.objects.filter(bgg=bgg).first()
+        if game_obj is None:
+            game_obj = create_game_obj(get_thing(bgg))
+    finally:
+        if locked:
+            try:
+                lock.release()
+            except LockError:
+                logger.warning('Creation lock for game %s expired before release', bgg)
+
+    return game_obj
+
+
+def create_game_obj(game_dict):
+    '''
+    Creates an instance of the Game class using data from the given dictionary,
+    or returns the existing game with the same BGG ID.
+    '''
+
+    fields = parse_game_fields(game_dict)
+    fields['refreshed_at'] = timezone.now()
+    bgg = fields.pop('bgg')
+
+    with transaction.atomic():
+        game_obj, created = Game.objects.get_or_create(bgg=bgg, defaults=fields)
+        if created:
+            category_ids = Category.objects.ids_for(parse_category_names(game_dict))
+            through = Game.categories.through
+            through.objects.bulk_create([through(game_id=game_obj.pk, category_id=pk) for pk in category_ids.values()])
+
+    return game_obj
+
+
+class GameImportPending(Exception):
+    '''
+    Raised when an import didn't finish within GAME_IMPORT_WAIT seconds.
+    '''
+
+    def __init__(self, bgg, result):
+        super().__init__(f"Import of BGG ID {bgg} is still running")
+        self.bgg = bgg
+        self.result = result
+
+
+class GameImportFailed(Exception):
+    '''
+    Raised when an import task failed for a reason other than BGG.
+    '''
+
+
+def start_game_import(bgg):
+    '''
+    Enqueues an import_game task for the given BGG ID and returns its
+    AsyncResult. While an import of the same ID is in flight, that task's
+    result is returned instead of starting another one.
+    '''
+
+    key = IMPORT_KEY.format(bgg)
+    task_id = str(uuid4())
+    if get_redis().set(key, task_id, nx=True, ex=settings.GAME_IMPORT_TTL):
+        return import_game.apply_async((bgg,), task_id=task_id)
+    result = current_game_import(bgg)
+    if result is None:
+        # the other import finished in the meantime
+        return start_game_import(bgg)
+    return result
+
+
+def current_game_import(bgg):
+    task_id = get_redis().get(IMPORT_KEY.format(bgg))
+    if task_id is None:
+        return None
+    return import_game.AsyncResult(task_id.decode())
+
+
+def finish_game_import(bgg, failed=False):
+    key = IMPORT_KEY.format(bgg)
+    if failed:
+        get_redis().expire(key, FAILED_IMPORT_TTL)
+    else:
+        get_redis().delete(key)
+
+
+def import_or_wait(bgg, timeout=None):
+    '''
+    Imports the given BGG ID through the task queue and waits up to timeout
+    seconds for it. Raises GameImportPending if the import is still running,
+    BGGError if BGG failed it and GameImportFailed if anything else did.
+    '''
+
+    if timeout is None:
+        timeout = settings.GAME_IMPORT_WAIT
+    result = start_game_import(bgg)
+    if timeout <= 0 and not result.ready():
+        raise GameImportPending(bgg, result)
+    try:
+        game_pk = result.get(timeout=timeout)
+    except CeleryTimeoutError:
+        raise GameImportPending(bgg, result)
+    except BGGError:
+        raise
+    except Exception as error:
+        # e.g. a concurrent import won the insert, its game is there by now
+        game = Game.objects.filter(bgg=bgg).first()
+        if game is not None:
+            return game
+        logger.exception('Import of BGG ID %s failed', bgg)
+        raise GameImportFailed(f"Import of BGG ID {bgg} failed: {error}") from error
+    return Game.objects.get(pk=game_pk)
+
+
+def fetch_game_data(bgg_ids, batch_size=None, refresh=False):
+    '''
+    Fetches the given BGG IDs in batches and returns a dictionary mapping each
+    ID BGG knows about to a (fields, category names) tuple. With refresh=True
+    the BGGThing cache is bypassed.
+    '''
+
+    batch_size = batch_size or settings.BGG_BATCH_SIZE
+    game_data = {}
+    for batch in chunked(list(bgg_ids), batch_size):
+        for game_dict in get_things(batch, refresh=refresh):
+            fields = parse_game_fields(game_dict)
+            game_data[fields['bgg']] = (fields, parse_category_names(game_dict))
+    return game_data
+
+
+def set_categories(category_names):
+    '''
+    Replaces the categories of several games with bulk statements on the
+    through table. Takes a dictionary mapping game pks to category names.
+    '''
+
+    names = [name for game_names in category_names.values() for name in game_names]
+    category_ids = Category.objects.ids_for(names)
+    through = Game.categories.through
+    links = []
+    for game_pk, game_names in category_names.items():
+        for name in dict.fromkeys(game_names):
+            links.append(through(game_id=game_pk, category_id=category_ids[name]))
+    with transaction.atomic():
+        through.objects.filter(game_id__in=category_names.keys()).delete()
+        through.objects.bulk_create(links)
+
+
+def create_games(game_data):
+    '''
+    Inserts the games of the given fetch_game_data result with one bulk insert
+    and sets the categories of the new ones. Returns a dictionary mapping
+    their BGG IDs to pks and the number of games inserted.
+    '''
+
+    now = timezone.now()
+    existing = set(Game.objects.filter(bgg__in=game_data.keys()).values_list('bgg', flat=True))
+    new_games = [Game(refreshed_at=now, **fields) for bgg, (fields, names) in game_data.items() if bgg not in existing]
+    with transaction.atomic():
+        # a concurrent import may insert the same games, the unique bgg column keeps one
+        Game.objects.bulk_create(new_games, ignore_conflicts=True)
+        game_ids = dict(Game.objects.filter(bgg__in=game_data.keys()).values_list('bgg', 'pk'))
+        set_categories({game_ids[game.bgg]: game_data[game.bgg][1] for game in new_games})
+    return game_ids, len(new_games)
+
+
+def import_collection(job):
+    '''
+    Runs a CollectionImport: fetches the games that aren't in the database
+    yet in batches, then links all of them to the user with one bulk insert.
+    Like Game.update_owners and update_wishlisted, owning a game takes it off
+    the wishlist and wishlisting it takes it out of the library.
+
+    A Running job is resumed: the games a previous run inserted count as
+    fetched and are not fetched again.
+    '''
+
+    if job.username and not (job.status == 'Running' and job.bgg_ids):
+        job.bgg_ids = get_collection_ids(job.username, wishlist=job.wishlist)
+    job.status = 'Running'
+    bgg_ids = list(dict.fromkeys(int(bgg) for bgg in job.bgg_ids))
+    game_ids = dict(Game.objects.filter(bgg__in=bgg_ids).values_list('bgg', 'pk'))
+    missing = [bgg for bgg in bgg_ids if bgg not in game_ids]
+    job.total = len(bgg_ids)
+    # games already in the database need no fetching
+    job.fetched = job.total - len(missing)
+    job.save(update_fields=['status', 'bgg_ids', 'total', 'fetched', 'updated_at'])
+
+    for batch in chunked(missing, settings.BGG_BATCH_SIZE):
+        created, created_num = create_games(fetch_game_data(batch))
+        game_ids.update(created)
+        job.fetched += len(batch)
+        job.new_games += created_num
+        job.save(update_fields=['fetched', 'new_games', 'updated_at'])
+
+    if job.wishlist:
+        through, opposite = Game.wishlisted.through, Game.owners.through
+    else:
+        through, opposite = Game.owners.through, Game.wishlisted.through
+    with transaction.atomic():
+        linked = set(through.objects.filter(customuser_id=job.user_id, game_id__in=game_ids.values()).values_list('game_id', flat=True))
+        links = [through(game_id=pk, customuser_id=job.user_id) for pk in game_ids.values() if pk not in linked]
+        through.objects.bulk_create(links, ignore_conflicts=True)
+        unlinked, _ = opposite.objects.filter(customuser_id=job.user_id, game_id__in=game_ids.values()).delete()
+        owned_changed = unlinked if job.wishlist else len(links)
+        if owned_changed:
+            UserStats.objects.mark_stale([job.user_id], UserStats.OWNED_GAME_SECTIONS)
+
+    job.linked = len(links)
+    job.status = 'Done'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['linked', 'status', 'finished_at', 'updated_at'])
+    logger.info('Collection import %s: %s games, %s new, %s linked', job.pk, job.total, job.new_games, job.linked)
+    return job
+
+
+def update_games(games, game_data):
+    '''
+    Applies freshly fetched BGG data to the given Game objects with one bulk
+    update and one bulk category replacement. Returns the updated games.
+    '''
+
+    updated = []
+    category_names = {}
+    for game in games:
+        if game.bgg not in game_data:
+            continue
+        fields, names = game_data[game.bgg]
+        for field in GAME_FIELDS:
+            setattr(game, field, fields[field])
+        updated.append(game)
+        category_names[game.pk] = names
+    with transaction.atomic():
+        Game.objects.bulk_update(updated, GAME_FIELDS)
+        set_categories(category_names)
+        # bulk updates skip the signals that keep the dashboard stats fresh
+        owner_ids = Game.owners.through.objects.filter(game_id__in=category_names.keys()).values_list('customuser_id', flat=True)
+        UserStats.objects.mark_stale(set(owner_ids), UserStats.OWNED_GAME_SECTIONS)
+    return updated
+
+
+def db_value(field, value):
+    '''
+    Rounds BGG decimals the way the column stores them, so that unchanged
+    values compare equal.
+    '''
+
+    if isinstance(value, Decimal):
+        places = Game._meta.get_field(field).decimal_places
+        return value.quantize(Decimal(1).scaleb(-places))
+    return value
+
+
+def refresh_batch(games, game_data):
+    '''
+    Writes the fields and categories that changed on BGG for the given
+    games, then marks all of them as refreshed. Returns the changed games.
+    '''
+
+    changed = {}
+    changed_fields = set()
+    category_names = {}
+    for game in games:
+        if game.bgg not in game_data:
+            continue
+        fields, names = game_data[game.bgg]
+        for field in GAME_FIELDS:
+            value = db_value(field, fields[field])
+            if getattr(game, field) != value:
+                setattr(game, field, value)
+                changed_fields.add(field)
+                changed[game.pk] = game
+        if {category.name for category in game.categories.all()} != set(names):
+            category_names[game.pk] = names
+            changed[game.pk] = game
+    with transaction.atomic():
+        if changed_fields:
+            Game.objects.bulk_update(list(changed.values()), sorted(changed_fields))
+        set_categories(category_names)
+        Game.objects.filter(pk__in=[game.pk for game in games]).update(refreshed_at=timezone.now())
+        if changed:
+            owner_ids = Game.owners.through.objects.filter(game_id__in=changed.keys()).values_list('customuser_id', flat=True)
+            UserStats.objects.mark_stale(set(owner_ids), UserStats.OWNED_GAME_SECTIONS)
+    return list(changed.values())
+
+
+def refresh_stale_games(budget=None, batch_size=None):
+    '''
+    Re-fetches the budget least recently refreshed games from BGG in multi-ID
+    batches and applies what changed. Games never refreshed go first. If BGG
+    can't be reached the run stops, leaving the remaining games for the next
+    one. Returns the number of games refreshed and the number that changed.
+    '''
+
+    budget = budget or settings.GAME_REFRESH_BUDGET
+    batch_size = batch_size or settings.BGG_BATCH_SIZE
+    queryset = Game.objects.order_by(F('refreshed_at').asc(nulls_first=True), 'pk').prefetch_related('categories')
+    games = list(queryset[:budget])
+    refreshed_num = 0
+    changed_num = 0
+    for batch in chunked(games, batch_size):
+        try:
+            game_data = fetch_game_data([game.bgg for game in batch], batch_size, refresh=True)
+        except BGGError as error:
+            logger.warning('Stopped refreshing games, BGG unavailable: %s', error)
+            break
+        changed_num += len(refresh_batch(batch, game_data))
+        refreshed_num += len(batch)
+    logger.info('Refreshed %s games from BGG, %s changed', refreshed_num, changed_num)
+    return refreshed_num, changed_num
+
+
+def read_checkpoint(path):
+    path = Path(path)
+    if not path.exists():
+        return 0
+    return int(path.read_text().strip() or 0)
+
+
+def write_checkpoint(path, game_pk):
+    Path(path).write_text(str(game_pk))
+
+
+def backfill_categories(batch_size=None, checkpoint=None, restart=False):
+    '''
+    Refreshes every Game and its categories from BGG in multi-ID batches,
+    ordered by pk. The last finished pk is written to a checkpoint file after
+    every batch, so an interrupted run resumes where it stopped.
+    '''
+
+    batch_size = batch_size or settings.BGG_BATCH_SIZE
+    checkpoint = checkpoint or settings.BGG_BACKFILL_CHECKPOINT
+    last_pk = 0 if restart else read_checkpoint(checkpoint)
+    if last_pk:
+        logger.info('Resuming category backfill after game %s', last_pk)
+    while True:
+        games = list(Game.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if len(games) == 0:
+            break
+        game_data = fetch_game_data([game.bgg for game in games], batch_size)
+        updated = update_games(games, game_data)
+        last_pk = games[-1].pk
+        write_checkpoint(checkpoint, last_pk)
+        logger.info('Backfilled %s of %s games up to game %s', len(updated), len(games), last_pk)
+    Path(checkpoint).unlink(missing_ok=True)
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from games import settings
+from .tasks import apply_on_commit, drain_outbox
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def queue_email(subject, message, recipient_list):
+    '''
+    Writes an email to the Outbox in the current transaction and wakes the
+    drain_outbox task once it commits. Inside email_batch() the rows are
+    inserted together when the block ends.
+    '''
+
+    from .models import Outbox
+
+    if len(recipient_list) == 0:
+        return
+    email = Outbox(subject=subject, message=message, recipient_list=list(recipient_list))
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        batch.append(email)
+    else:
+        email.save()
+        apply_on_commit(drain_outbox)
+
+
+@contextmanager
+def email_batch():
+    '''
+    Collects the emails queued inside the block into one Outbox insert.
+    Nested batches join the outermost one.
+    '''
+
+    from .models import Outbox
+
+    if getattr(_local, 'batch', None) is not None:
+        yield
+        return
+    _local.batch = batch = []
+    try:
+        yield
+    finally:
+        _local.batch = None
+    if batch:
+        Outbox.objects.bulk_create(batch)
+        apply_on_commit(drain_outbox)
+
+
+def retry_delay(attempts):
+    return min(settings.OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1), settings.OUTBOX_MAX_RETRY_DELAY)
+
+
+def deliver(emails):
+    '''
+    Sends the given Outbox rows over one SMTP connection and updates each
+    row: sent, scheduled for a retry with exponential backoff, or failed for
+    good after OUTBOX_MAX_ATTEMPTS. Returns the number sent.
+    '''
+
+    connection = get_connection()
+    sent = 0
+    try:
+        connection.open()
+    except Exception as error:
+        opened, open_error = False, error
+    else:
+        opened, open_error = True, None
+    try:
+        for email in emails:
+            error = open_error
+            if opened:
+                message = EmailMessage(
+                    subject=email.subject,
+                    body=email.message,
+                    from_email=settings.EMAIL_HOST_USER,
+                    to=email.recipient_list,
+                    connection=connection
+                )
+                try:
+                    connection.send_messages([message])
+                except Exception as send_error:
+                    error = send_error
+            email.attempts += 1
+            if error is None:
+                email.status = 'Sent'
+                email.sent_at = timezone.now()
+                email.last_error = None
+                sent += 1
+                continue
+            email.last_error = str(error)
+            if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                email.status = 'Failed'
+                logger.error('Giving up on outbox email %s: %s', email.pk, error)
+            else:
+                email.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+    finally:
+        if opened:
+            connection.close()
+    return sent
+
+
+def claim(batch_size):
+    '''
+    Leases up to batch_size due Outbox rows to the caller by moving their
+    next_attempt_at OUTBOX_LEASE seconds ahead, in a short transaction of
+    its own. Other workers skip the rows until the lease runs out, so a
+    worker that dies mid-batch only delays its emails.
+    '''
+
+    from .models import Outbox
+
+    with transaction.atomic():
+        emails = list(Outbox.objects.due().select_for_update(skip_locked=True)[:batch_size])
+        lease = timezone.now() + timedelta(seconds=settings.OUTBOX_LEASE)
+        Outbox.objects.filter(pk__in=[email.pk for email in emails]).update(next_attempt_at=lease)
+    return emails
+
+
+def drain(batch_size=None):
+    '''
+    Claims due Outbox rows in batches, so several workers can drain side by
+    side, and delivers each batch over one connection outside of any
+    transaction. Returns throughput and lag metrics for the run.
+    '''
+
+    from .models import Outbox
+
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    metrics = {'sent': 0, 'retried': 0, 'failed': 0, 'max_lag': 0.0}
+    start = time.monotonic()
+    while True:
+        emails = claim(batch_size)
+        if len(emails) == 0:
+            break
+        deliver(emails)
+        Outbox.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at', 'sent_at', 'last_error'])
+        for email in emails:
+            if email.status == 'Sent':
+                metrics['sent'] += 1
+                metrics['max_lag'] = max(metrics['max_lag'], (email.sent_at - email.created_at).total_seconds())
+            elif email.status == 'Failed':
+                metrics['failed'] += 1
+            else:
+                metrics['retried'] += 1
+        if len(emails) < batch_size:
+            break
+    elapsed = time.monotonic() - start
+    metrics['elapsed'] = elapsed
+    metrics['throughput'] = metrics['sent'] / elapsed if elapsed else 0.0
+    if metrics['sent'] or metrics['retried'] or metrics['failed']:
+        logger.info(
+            'Outbox drained: %s sent, %s to retry, %s failed in %.3fs (%.1f/s, max lag %.1fs)',
+            metrics['sent'], metrics['retried'], metrics['failed'], elapsed, metrics['throughput'], metrics['max_lag']
+        )
+    return metrics
@@ -0,0 +1,57 @@
+import base64
+import json
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from api.models import BGGThing
+
+
+class Command(BaseCommand):
+    help = 'Prunes, exports or imports the local cache of BGG thing responses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['prune', 'export', 'import'])
+        parser.add_argument('path', nargs='?', help='JSON lines file to export to or import from.')
+        parser.add_argument('--max-age', type=int, help='prune: remove entries older than this many seconds (defaults to BGG_CACHE_TTL).')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'prune':
+            deleted, _ = BGGThing.objects.expired(options['max_age']).delete()
+            self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} cache entries.'))
+            return
+        if options['path'] is None:
+            raise CommandError(f'{action} needs a path.')
+        if action == 'export':
+            self.export_cache(options['path'])
+        else:
+            self.import_cache(options['path'])
+
+    def export_cache(self, path):
+        count = 0
+        with open(path, 'w') as export_file:
+            for thing in BGGThing.objects.order_by('bgg').iterator():
+                export_file.write(json.dumps({
+                    'bgg': thing.bgg,
+                    'fetched_at': thing.fetched_at.isoformat(),
+                    'data': base64.b64encode(bytes(thing.data)).decode('ascii'),
+                }) + '\n')
+                count += 1
+        self.stdout.write(self.style.SUCCESS(f'Exported {count} cache entries to {path}.'))
+
+    def import_cache(self, path):
+        '''
+        Loads entries from an export, keeping whichever copy of an entry was
+        fetched most recently.
+        '''
+        with open(path) as import_file:
+            rows = [json.loads(line) for line in import_file if line.strip()]
+        existing = dict(BGGThing.objects.filter(bgg__in=[row['bgg'] for row in rows]).values_list('bgg', 'fetched_at'))
+        imported = []
+        for row in rows:
+            fetched_at = datetime.fromisoformat(row['fetched_at'])
+            if row['bgg'] in existing and existing[row['bgg']] >= fetched_at:
+                continue
+            imported.append(BGGThing(bgg=row['bgg'], data=base64.b64decode(row['data']), fetched_at=fetched_at))
+        BGGThing.objects.filter(bgg__in=[thing.bgg for thing in imported]).delete()
+        BGGThing.objects.bulk_create(imported)
+        self.stdout.write(self.style.SUCCESS(f'Imported {len(imported)} of {len(rows)} cache entries.'))
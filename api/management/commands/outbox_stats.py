@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.models import Outbox
+
+
+class Command(BaseCommand):
+    help = 'Shows the email outbox backlog, lag and throughput.'
+
+    def handle(self, *args, **options):
+        stats = Outbox.objects.stats()
+        self.stdout.write(f"Pending: {stats['pending']}")
+        self.stdout.write(f"Oldest pending: {stats['lag']:.0f}s")
+        self.stdout.write(f"Sent in the last hour: {stats['sent_last_hour']}")
+        self.stdout.write(f"Failed: {stats['failed']}")
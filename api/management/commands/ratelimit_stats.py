@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from api.ratelimit import bgg_limiter
+
+
+class Command(BaseCommand):
+    help = 'Shows how often BGG calls waited for or were refused a rate limit token.'
+
+    def handle(self, *args, **options):
+        limiter = bgg_limiter()
+        if limiter is None:
+            self.stdout.write('BGG rate limiting is off (BGG_RATE_LIMIT is 0).')
+            return
+        stats = limiter.shared_metrics()
+        self.stdout.write(f"Acquired: {stats['acquired']}")
+        self.stdout.write(f"Waited: {stats['waits']}")
+        self.stdout.write(f"Total wait: {stats['total_wait']:.1f}s")
+        self.stdout.write(f"Rejected: {stats['rejections']}")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from api.models import CustomUser, UserStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the persisted dashboard stats from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only rebuild the stats for these users.')
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        count = 0
+        for user in users.iterator():
+            UserStats.objects.refresh(user, full=True)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {count} user(s).'))
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.1 on 2026-10-18 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_userstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BGGThing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bgg', models.IntegerField(unique=True)),
+                ('data', models.BinaryField()),
+                ('fetched_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
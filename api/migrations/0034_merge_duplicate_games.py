@@ -0,0 +1,61 @@
+# Generated by Django 4.0.1 on 2026-10-18 07:40
+
+from django.db import migrations
+from django.db.models import Count, F
+
+
+def merge_links(model, game_field, other_fields, keeper, duplicates):
+    '''
+    Moves the rows of model pointing at the duplicates over to keeper, dropping
+    the ones keeper already has.
+    '''
+
+    existing = set(model.objects.filter(**{game_field: keeper}).values_list(*other_fields))
+    for row in model.objects.filter(**{f'{game_field}__in': duplicates}):
+        key = tuple(getattr(row, field) for field in other_fields)
+        if key in existing:
+            row.delete()
+            continue
+        setattr(row, game_field, keeper)
+        row.save(update_fields=[game_field])
+        existing.add(key)
+
+
+def merge_duplicate_games(apps, schema_editor):
+    Game = apps.get_model('api', 'Game')
+    GameNight = apps.get_model('api', 'GameNight')
+    Voting = apps.get_model('api', 'Voting')
+    GameFeedback = apps.get_model('api', 'GameFeedback')
+    UserStats = apps.get_model('api', 'UserStats')
+
+    links = [
+        (Game.owners.through, 'game_id', ['customuser_id']),
+        (Game.wishlisted.through, 'game_id', ['customuser_id']),
+        (Game.tags.through, 'game_id', ['tag_id']),
+        (Game.categories.through, 'game_id', ['category_id']),
+        (GameNight.games.through, 'game_id', ['gamenight_id']),
+        (GameNight.options.through, 'game_id', ['gamenight_id']),
+        (Voting, 'game_id', ['gamenight_id', 'invitee_id']),
+        (GameFeedback, 'game_id', ['gamenight_id', 'attendee_id']),
+    ]
+    duplicated = Game.objects.values('bgg').annotate(game_num=Count('pk')).filter(game_num__gt=1).values_list('bgg', flat=True)
+    merged = False
+    for bgg in list(duplicated):
+        keeper, *duplicates = Game.objects.filter(bgg=bgg).order_by('pk').values_list('pk', flat=True)
+        for model, game_field, other_fields in links:
+            merge_links(model, game_field, other_fields, keeper, duplicates)
+        Game.objects.filter(pk__in=duplicates).delete()
+        merged = True
+    if merged:
+        UserStats.objects.update(version=F('version') + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0033_bggthing'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_games, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.1 on 2026-10-18 07:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0034_merge_duplicate_games'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='game',
+            name='bgg',
+            field=models.IntegerField(unique=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.1 on 2026-10-18 08:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0035_game_bgg_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(blank=True, max_length=100, null=True)),
+                ('bgg_ids', models.JSONField(blank=True, default=list)),
+                ('wishlist', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Running', 'Running'), ('Done', 'Done'), ('Failed', 'Failed')], default='Pending', max_length=7)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('fetched', models.PositiveIntegerField(default=0)),
+                ('new_games', models.PositiveIntegerField(default=0)),
+                ('linked', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='collection_imports', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
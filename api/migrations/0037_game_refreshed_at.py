@@ -0,0 +1,18 @@
+# Generated by Django 4.0.1 on 2026-10-18 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0036_collectionimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='refreshed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0037_game_refreshed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InviteNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('contact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invite_notifications', to='api.contact')),
+                ('gamenight', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invite_notifications', to='api.gamenight')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('gamenight', 'contact'), name='unique-invite-notification')],
+            },
+        ),
+    ]
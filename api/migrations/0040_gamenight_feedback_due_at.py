@@ -0,0 +1,40 @@
+# Generated by Django 4.0.1 on 2026-10-18 10:50
+
+import datetime
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def copy_scheduled_feedback(apps, schema_editor):
+    '''
+    Carries feedback requests still waiting in ETA tasks over to
+    feedback_due_at. Those tasks are dropped with the feedback_email task.
+    '''
+
+    GameNight = apps.get_model('api', 'GameNight')
+    now = timezone.now()
+    for gamenight in GameNight.objects.filter(status='Finalized', feedback_task__isnull=False, date__gte=now.date() - datetime.timedelta(days=1)):
+        due_at = timezone.make_aware(datetime.datetime.combine(gamenight.date + datetime.timedelta(days=1), datetime.time(12)))
+        if due_at > now:
+            gamenight.feedback_due_at = due_at
+            gamenight.save(update_fields=['feedback_due_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamenight',
+            name='feedback_due_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(copy_scheduled_feedback, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='gamenight',
+            name='feedback_task',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.1 on 2026-10-18 11:20
+
+import datetime
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_starts_at(apps, schema_editor):
+    GameNight = apps.get_model('api', 'GameNight')
+    gamenights = list(GameNight.objects.all())
+    for gamenight in gamenights:
+        gamenight.starts_at = timezone.make_aware(datetime.datetime.combine(gamenight.date, gamenight.start_time))
+    GameNight.objects.bulk_update(gamenights, ['starts_at'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_gamenight_feedback_due_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamenight',
+            name='reminder_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gamenight',
+            name='starts_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_starts_at, migrations.RunPython.noop),
+    ]
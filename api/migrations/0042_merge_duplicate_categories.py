@@ -0,0 +1,35 @@
+# Generated by Django 4.0.1 on 2026-10-18 12:05
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_categories(apps, schema_editor):
+    '''
+    Keeps the lowest pk of every category name stored more than once and
+    moves the games of the other copies onto it before deleting them.
+    '''
+
+    Category = apps.get_model('api', 'Category')
+    Game = apps.get_model('api', 'Game')
+    through = Game.categories.through
+    duplicates = Category.objects.values('name').annotate(keep=Min('pk'), copies=Count('pk')).filter(copies__gt=1)
+    for duplicate in duplicates:
+        keep = duplicate['keep']
+        extra = list(Category.objects.filter(name=duplicate['name']).exclude(pk=keep).values_list('pk', flat=True))
+        linked = set(through.objects.filter(category_id=keep).values_list('game_id', flat=True))
+        game_ids = set(through.objects.filter(category_id__in=extra).values_list('game_id', flat=True)) - linked
+        through.objects.bulk_create([through(game_id=game_id, category_id=keep) for game_id in game_ids])
+        # deleting the copies removes their through rows too
+        Category.objects.filter(pk__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0041_gamenight_starts_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_categories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.1 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0042_merge_duplicate_categories'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=150, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.1 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0043_category_name_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='stale_sections',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
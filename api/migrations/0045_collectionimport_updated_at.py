@@ -0,0 +1,20 @@
+# Generated by Django 4.0.1 on 2026-10-18 14:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0044_userstats_stale_sections'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectionimport',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -1,13 +1,46 @@
 from telnetlib import STATUS
 from time import strftime
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Sum, Min, Max, F, OuterRef, Subquery, ExpressionWrapper, Prefetch
+from django.db.models.functions import Cast, Coalesce, ExtractIsoWeekDay, NullIf
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.core.mail import send_mail
+from django.utils import timezone
 from games import settings
-from datetime import datetime, timedelta
-from .tasks import feedback_email
-from celery.result import AsyncResult
+from datetime import datetime, time, timedelta
+from .tasks import apply_on_commit, flush_invite_notifications
+from .mail import queue_email, email_batch
+import json
+import zlib
+
+
+def count_subquery(model, field):
+    '''
+    Returns an expression counting the rows of the given model whose field
+    points at the outer query's pk.
+    '''
+
+    queryset = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(num=Count('pk')).values('num')
+    return Coalesce(Subquery(queryset, output_field=models.IntegerField()), 0)
+
+
+def session_length(date, t1, t2):
+    '''
+    Returns the length (in minutes) of a session on the given date, treating
+    an end time earlier than the start time as running past midnight.
+    '''
+
+    if t2 == None:
+        return None
+    d1 = datetime(date.year, date.month, date.day, t1.hour, t1.minute)
+    if t1.hour > t2.hour:
+        diff = timedelta(days=1)
+        dt = datetime(date.year, date.month, date.day, t2.hour, t2.minute)
+        d2 = dt + diff
+    else:
+        d2 = datetime(date.year, date.month, date.day, t2.hour, t2.minute)
+    delta = d2 - d1
+    return delta.total_seconds()/60
 
 
 class CustomUser(AbstractUser):
@@ -20,6 +53,97 @@ class CustomUser(AbstractUser):
         return f"{self.username}"
 
 
+class GameNightQuerySet(models.QuerySet):
+
+    def with_counts(self):
+        '''
+        Annotates each GameNight with the number of invitees, attendees,
+        options and games, each computed in SQL.
+        '''
+
+        return self.annotate(
+            invitee_num=count_subquery(GameNight.invitees.through, 'gamenight'),
+            attendee_num=count_subquery(GameNight.attendees.through, 'gamenight'),
+            option_num=count_subquery(GameNight.options.through, 'gamenight'),
+            game_num=count_subquery(GameNight.games.through, 'gamenight'),
+        )
+
+    def with_stat_counts(self):
+        '''
+        Annotates each GameNight with its ISO weekday plus the attendee,
+        invitee, game and overall feedback aggregates, all computed in SQL.
+        '''
+
+        overall_total = GeneralFeedback.objects.filter(gamenight=OuterRef('pk')).order_by().values('gamenight').annotate(total=Sum('overall_rating')).values('total')
+        return self.annotate(
+            weekday=ExtractIsoWeekDay('date'),
+            attendee_num=count_subquery(GameNight.attendees.through, 'gamenight'),
+            invitee_num=count_subquery(GameNight.invitees.through, 'gamenight'),
+            game_num=count_subquery(GameNight.games.through, 'gamenight'),
+            overall_total=Coalesce(Subquery(overall_total, output_field=models.IntegerField()), 0),
+            overall_num=count_subquery(GeneralFeedback, 'gamenight'),
+        )
+
+    def with_related(self):
+        '''
+        Loads every relation rendered by GameNightSerializer up front, so
+        serializing GameNights costs a fixed number of queries no matter how
+        many invitees, options or comments they have.
+        '''
+
+        return self.select_related('user').prefetch_related(
+            Prefetch('invitees', queryset=Contact.objects.with_attendance()),
+            Prefetch('rsvps', queryset=RSVP.objects.select_related('invitee')),
+            Prefetch('attendees', queryset=Contact.objects.with_attendance()),
+            Prefetch('games', queryset=Game.objects.prefetch_related('categories')),
+            Prefetch('options', queryset=Game.objects.prefetch_related('categories')),
+            Prefetch('generalfeedback', queryset=GeneralFeedback.objects.select_related('attendee')),
+        )
+
+    def send_due_feedback(self):
+        '''
+        Queues the feedback request of every Finalized GameNight whose
+        feedback_due_at has passed and clears it, in one transaction, so each
+        request goes out once. Returns the number of GameNights handled.
+        '''
+
+        with transaction.atomic(), email_batch():
+            gamenights = list(
+                self.filter(status='Finalized', feedback_due_at__lte=timezone.now())
+                .select_for_update(skip_locked=True)
+                .prefetch_related('attendees')
+            )
+            for gamenight in gamenights:
+                gamenight.mail_feedback()
+            self.filter(pk__in=[gamenight.pk for gamenight in gamenights]).update(feedback_due_at=None)
+        return len(gamenights)
+
+    def send_due_reminders(self):
+        '''
+        Queues a reminder for every Finalized GameNight starting within the
+        next REMINDER_HOURS hours that hasn't had one, and marks it sent in
+        the same transaction, so each reminder goes out once. Returns the
+        number of GameNights handled.
+        '''
+
+        now = timezone.now()
+        with transaction.atomic(), email_batch():
+            gamenights = list(
+                self.filter(
+                    status='Finalized',
+                    reminder_sent_at=None,
+                    starts_at__gt=now,
+                    starts_at__lte=now + timedelta(hours=settings.REMINDER_HOURS),
+                )
+                .select_for_update(skip_locked=True)
+                .prefetch_related('attendees')
+            )
+            for gamenight in gamenights:
+                gamenight.mail_reminder()
+            self.filter(pk__in=[gamenight.pk for gamenight in gamenights]).update(reminder_sent_at=now)
+        return len(gamenights)
+
+
 class GameNight(models.Model):
     class Meta:
         constraints = [
@@ -43,23 +167,38 @@ class GameNight(models.Model):
     end_time = models.TimeField(null=True)
     location = models.CharField(max_length=300)
     options = models.ManyToManyField('Game', related_name='options', blank=True)
-    feedback_task = models.CharField(max_length=50, null=True, blank=True)
+    feedback_due_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # date + start_time, kept in sync by save() for the reminder sweep
+    starts_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = GameNightQuerySet.as_manager()
 
     def __repr__(self):
         return f"<GameNight rid:{self.rid}>"
 
     def __str__(self):
         return f"{self.rid}"
+
+    def save(self, *args, **kwargs):
+        starts_at = timezone.make_aware(datetime.combine(self.date, self.start_time))
+        if starts_at != self.starts_at:
+            # a moved GameNight gets a reminder for its new time
+            self.starts_at = starts_at
+            self.reminder_sent_at = None
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'starts_at', 'reminder_sent_at'}
+        super().save(*args, **kwargs)
     
     def mail_gamenight_create(self):
         invitees_list = self.invitees.all()
         email_list = []
         for invitee in invitees_list:           
             email_list.append(invitee.email)
-        send_mail(
+        InviteNotification.objects.mark_sent(self, invitees_list)
+        queue_email(
             subject=( f'Game night! {self.date.strftime("%b %d")} at {self.start_time.strftime("%I:%M %p")}.  Be there!'),
             message=( f'Please join us on {self.date.strftime("%b %d")} for super duper fun at {self.location}. Lets get started at {self.start_time.strftime("%I:%M %p")}  Click the url for details!  https://game-knight.netlify.app/game_night/{self.rid}/'),
-            from_email=settings.EMAIL_HOST_USER,
             recipient_list=email_list
             )
 
@@ -67,10 +206,9 @@ class GameNight(models.Model):
 #not sure how to get updated invitees 
     def mail_update_invitees(self, new_emails):
 
-        send_mail(
+        queue_email(
             subject=( f'Game night! {self.date.strftime("%b %d")} at {self.start_time.strftime("%I:%M %p")}.  Be there!'),
             message=( f'Please join us on {self.date.strftime("%b %d")} for super duper fun at {self.location}. Lets get started at {self.start_time.strftime("%I:%M %p")}  Click the url for details!  https://game-knight.netlify.app/game_night/{self.rid}/'),
-            from_email=settings.EMAIL_HOST_USER,
             recipient_list=new_emails
             )
 
@@ -80,10 +218,9 @@ class GameNight(models.Model):
         email_list = []
         for attendee in attendees_list:           
             email_list.append(attendee.email)
-        send_mail(
+        queue_email(
             subject=( f'We are all set for game night on {self.date.strftime("%b %d")} at {self.start_time.strftime("%I:%M %p")}.'),
             message=( f'We are excited to see you on {self.date.strftime("%b %d")} at {self.location}. Lets get started at {self.start_time.strftime("%I:%M %p")}.  Click the url again for details!  https://game-knight.netlify.app/game_night/{self.rid}/  See you there!'),
-            from_email=settings.EMAIL_HOST_USER,
             recipient_list=email_list
             )
 
@@ -95,7 +232,7 @@ class GameNight(models.Model):
                 attendees_list.remove(contact)
             else:
                 attendees_list.add(contact)
-        self.update_feedback_task()
+        self.update_feedback()
 
     def update_invitees(self, contact_pk):
         invitees_list = self.invitees
@@ -104,9 +241,10 @@ class GameNight(models.Model):
             invitees_list.remove(contact)
             if contact in self.attendees.all():
                 self.attendees.remove(contact)
+            InviteNotification.objects.unqueue(self, contact)
         else:
             invitees_list.add(contact)
-            self.mail_update_invitees([contact.email])
+            InviteNotification.objects.queue(self, contact)
 
     def update_options(self, game_pk):
         options_list = self.options
@@ -127,6 +265,15 @@ class GameNight(models.Model):
             else:
                 games_list.add(game)
 
+    def vote_tallies(self):
+        '''
+        Returns a dictionary mapping game pks to the sum of the votes they got
+        for this GameNight, using a single query.
+        '''
+
+        rows = self.voting.order_by().values('game').annotate(total=Sum('vote'))
+        return {row['game']: row['total'] for row in rows}
+
     def calc_feedback(self):
         feedbacks = GeneralFeedback.objects.filter(gamenight=self)
         if len(feedbacks) == 0:
@@ -152,47 +299,47 @@ class GameNight(models.Model):
         return overall_avg
 
     def calc_session_len(self):
-        date = self.date
-        t1 = self.start_time
-        t2 = self.end_time
-        if t2 == None:
-            return None
-        d1 = datetime(date.year, date.month, date.day, t1.hour, t1.minute)
-        if t1.hour > t2.hour:
-            diff = timedelta(days=1)
-            dt = datetime(date.year, date.month, date.day, t2.hour, t2.minute)
-            d2 = dt + diff
-        else:
-            d2 = datetime(date.year, date.month, date.day, t2.hour, t2.minute)
-        delta = d2 - d1
-        return delta.total_seconds()/60
+        return session_length(self.date, self.start_time, self.end_time)
 
-    def schedule_feedback_task(self):
+    def mail_feedback(self):
         gn_date = self.date
-        fback_datetime = datetime(gn_date.year, gn_date.month, gn_date.day+1, 12)
         subject = 'Your Feedback is Requested!'
         message = f"Thank you so much for attending my GameKnight on {str(gn_date)}! Please follow the link below to complete a short feedback survey: https://game-knight.netlify.app/game_night/{self.rid}/feedback"
         email_list = []
         for contact in self.attendees.all():
             email_list.append(contact.email)
-        task = feedback_email.apply_async(
-            kwargs={
-                'subject': subject,
-                'message': message,
-                'email_list': email_list
-            },
-            eta=fback_datetime
-        )
-        self.feedback_task = task.id
-        self.save()
+        queue_email(
+            subject=subject,
+            message=message,
+            recipient_list=email_list
+            )
 
-    def update_feedback_task(self):
-        if self.feedback_task is not None:
-            result = AsyncResult(id=self.feedback_task)
-            result.revoke()
+    def mail_reminder(self):
+        email_list = []
+        for attendee in self.attendees.all():
+            email_list.append(attendee.email)
+        queue_email(
+            subject=( f'Reminder: game night on {self.date.strftime("%b %d")} at {self.start_time.strftime("%I:%M %p")}.'),
+            message=( f'Just a reminder that game night is coming up on {self.date.strftime("%b %d")} at {self.location}. Lets get started at {self.start_time.strftime("%I:%M %p")}.  Click the url for details!  https://game-knight.netlify.app/game_night/{self.rid}/  See you there!'),
+            recipient_list=email_list
+            )
+
+    def schedule_feedback(self):
+        '''
+        Asks for feedback at noon the day after the GameNight, see
+        GameNightQuerySet.send_due_feedback.
+        '''
+
+        self.feedback_due_at = timezone.make_aware(datetime.combine(self.date + timedelta(days=1), time(12)))
+        self.save(update_fields=['feedback_due_at'])
+
+    def update_feedback(self):
         if self.status == 'Finalized':
-            self.schedule_feedback_task()
+            self.schedule_feedback()
             self.mail_finalized()
+        elif self.feedback_due_at is not None:
+            self.feedback_due_at = None
+            self.save(update_fields=['feedback_due_at'])
 
 
 class Tag(models.Model):
@@ -205,9 +352,54 @@ class Tag(models.Model):
     def __str__(self):
         return f"{self.name}"
 
+# process-wide name -> pk map of the Category table, see CategoryManager
+_category_ids = None
+
+
+class CategoryManager(models.Manager):
+
+    def name_map(self, reload=False):
+        '''
+        Returns the cached dictionary mapping category names to pks, loading
+        it on first use. The cache is dropped whenever a Category is saved or
+        deleted in this process.
+        '''
+
+        global _category_ids
+        if _category_ids is None or reload:
+            _category_ids = dict(self.values_list('name', 'pk'))
+        return _category_ids
+
+    def invalidate(self):
+        global _category_ids
+        _category_ids = None
+
+    def ids_for(self, names):
+        '''
+        Returns a dictionary mapping the given names to category pks, creating
+        the categories that don't exist yet in one bulk insert. Names inserted
+        by another process in the meantime are skipped by the unique name.
+        '''
+
+        names = list(dict.fromkeys(names))
+        category_ids = self.name_map()
+        if any(name not in category_ids for name in names):
+            # another process may have added them since the map was loaded
+            category_ids = self.name_map(reload=True)
+        missing = [name for name in names if name not in category_ids]
+        if missing:
+            self.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+            # not cached until the next load, in case the transaction rolls back
+            self.invalidate()
+            category_ids = dict(self.filter(name__in=names).values_list('name', 'pk'))
+        return {name: category_ids[name] for name in names}
+
+
 class Category(models.Model):
 
-    name = models.CharField(max_length=150)
+    name = models.CharField(max_length=150, unique=True)
+
+    objects = CategoryManager()
 
     def __repr__(self):
         return f"<Category name: {self.name}>"
@@ -236,6 +428,87 @@ class GeneralFeedback(models.Model):
         return f"GeneralFeedback from {self.attendee.first_name} {self.attendee.last_name}"
 
 
+class ContactQuerySet(models.QuerySet):
+
+    def with_attendance(self):
+        '''
+        Annotates each contact with the number of GameNights they attended and
+        were invited to, plus their attendance rate as a percentage (null when
+        they were never invited).
+        '''
+
+        return self.annotate(
+            attended_num=count_subquery(GameNight.attendees.through, 'contact'),
+            invited_num=count_subquery(GameNight.invitees.through, 'contact'),
+        ).annotate(
+            attend_rate=ExpressionWrapper(
+                Cast('attended_num', models.FloatField()) / NullIf(F('invited_num'), 0) * 100,
+                output_field=models.FloatField()
+            )
+        )
+
+    def favorite_games(self):
+        '''
+        Returns a dictionary mapping the pks of the contacts in the queryset to
+        their top 5 games by average feedback rating, using one aggregate query
+        for feedback and one for votes. Contacts without feedback are left out.
+        '''
+
+        contacts = self.values('pk')
+        feedback_rows = GameFeedback.objects.filter(attendee__in=contacts).values(
+            'attendee',
+            'game',
+            'game__title',
+            'game__bgg',
+            'game__pub_year',
+            'game__image',
+        ).annotate(total=Sum('rating'), num=Count('pk'), first=Min('pk')).order_by('attendee', 'first')
+        vote_rows = Voting.objects.filter(invitee__in=contacts).values('invitee', 'game__title').annotate(total=Sum('vote')).order_by()
+
+        fback_dicts = {}
+        for row in feedback_rows:
+            games = fback_dicts.setdefault(row['attendee'], {})
+            title = row['game__title']
+            if title in games:
+                games[title]['total'] += row['total']
+                games[title]['num'] += row['num']
+            else:
+                games[title] = {
+                    'total': row['total'],
+                    'num': row['num'],
+                    'bgg': row['game__bgg'],
+                    'pub_year': row['game__pub_year'],
+                    'image': row['game__image'],
+                }
+        votes_dicts = {}
+        for row in vote_rows:
+            votes = votes_dicts.setdefault(row['invitee'], {})
+            votes[row['game__title']] = votes.get(row['game__title'], 0) + row['total']
+
+        favorites = {}
+        for contact_pk, games in fback_dicts.items():
+            votes = votes_dicts.get(contact_pk, {})
+            fback_avg_dict = {title: game['total']/game['num'] for title, game in games.items()}
+            fback_sort = sorted(fback_avg_dict, key=fback_avg_dict.__getitem__)
+            final_list = []
+            for title in reversed(fback_sort):
+                game = games[title]
+                final_list.append(
+                    {
+                        'title': title,
+                        'bgg': game['bgg'],
+                        'pub_year': game['pub_year'],
+                        'image': game['image'],
+                        'avg_feedback': fback_avg_dict[title],
+                        'accum_votes': votes.get(title, 0)
+                    }
+                )
+                if len(final_list) == 5:
+                    break
+            favorites[contact_pk] = final_list
+        return favorites
+
+
 class Contact(models.Model):
     class Meta:
         constraints = [
@@ -246,7 +519,9 @@ class Contact(models.Model):
     first_name = models.CharField(max_length=150)
     last_name = models.CharField(max_length=150)
     email = models.EmailField(max_length=254)
-    
+
+    objects = ContactQuerySet.as_manager()
+
     def __repr__(self):
         return f"<Contact {self.first_name} {self.last_name}>"
 
@@ -254,58 +529,23 @@ class Contact(models.Model):
         return f"{self.first_name} {self.last_name}"
 
     def attend_percent(self):
-        attended = len(self.attended.all())
-        invited = len(self.invited.all())
-        if invited == 0:
+        '''
+        Returns the attendance rate, reading the annotation added by
+        ContactQuerySet.with_attendance when it is present.
+        '''
+
+        if hasattr(self, 'attend_rate'):
+            rate = self.attend_rate
+        else:
+            attended = self.attended.count()
+            invited = self.invited.count()
+            rate = None if invited == 0 else (attended/invited)*100
+        if rate is None:
             return 0
-        return round((attended/invited)*100, 2)
+        return round(rate, 2)
 
     def fav_games(self):
-        votes = self.voting.all()
-        gamefbacks = self.gamefeedback.all()
-        voted_games_dict = {}
-        fback_total_dict = {}
-        fback_count_dict = {}
-        fback_avg_dict = {}
-        game_dict = {}
-        for fback in gamefbacks:
-            game = fback.game
-            if game.title in fback_total_dict:
-                fback_total_dict[game.title] += fback.rating
-            else:
-                fback_total_dict[game.title] = fback.rating
-                voted_games_dict[game.title] = 0
-            if game.title in fback_count_dict:
-                fback_count_dict[game.title] += 1
-            else:
-                fback_count_dict[game.title] = 1
-            if game.title not in game_dict:
-                game_dict[game.title] = game
-        for game in fback_total_dict.keys():
-            fback_avg_dict[game] = fback_total_dict[game]/fback_count_dict[game]
-        for vote in votes:
-            game = vote.game
-            if game.title in voted_games_dict:
-                voted_games_dict[game.title] += vote.vote
-            else:
-                voted_games_dict[game.title] = vote.vote
-        fback_sort = sorted(fback_avg_dict, key=fback_avg_dict.__getitem__)
-        final_list = []
-        for game in reversed(fback_sort):
-            game_obj = game_dict[game]
-            final_list.append(
-                {
-                    'title': game,
-                    'bgg': game_obj.bgg,
-                    'pub_year': game_obj.pub_year,
-                    'image': game_obj.image,
-                    'avg_feedback': fback_avg_dict[game],
-                    'accum_votes': voted_games_dict[game]
-                }
-            )
-            if len(final_list) == 5:
-                break
-        return final_list
+        return Contact.objects.filter(pk=self.pk).favorite_games().get(self.pk, [])
 
 
 class Voting(models.Model):
@@ -343,9 +583,29 @@ class GameFeedback(models.Model):
         return {self.feedback}
 
 
+class GameQuerySet(models.QuerySet):
+
+    def with_feedback(self, user):
+        '''
+        Annotates each game with the total and number of GameFeedback ratings
+        it received at the given user's GameNights, mirroring
+        Game.calc_feedback in a single query.
+        '''
+
+        feedback = GameFeedback.objects.filter(
+            game=OuterRef('pk'),
+            gamenight__user=user,
+            gamenight__games=OuterRef('pk')
+        ).order_by().values('game')
+        return self.annotate(
+            feedback_total=Coalesce(Subquery(feedback.annotate(total=Sum('rating')).values('total'), output_field=models.IntegerField()), 0),
+            feedback_num=Coalesce(Subquery(feedback.annotate(num=Count('pk')).values('num'), output_field=models.IntegerField()), 0),
+        )
+
+
 class Game(models.Model):
     title = models.CharField(max_length=250)
-    bgg = models.IntegerField()
+    bgg = models.IntegerField(unique=True)
     pub_year = models.IntegerField()
     description = models.TextField(null=True, blank=True)
     min_players = models.IntegerField(null=True, blank=True)
@@ -358,6 +618,9 @@ class Game(models.Model):
     wishlisted = models.ManyToManyField('CustomUser', related_name='wishlist', blank=True)
     tags = models.ManyToManyField('Tag', related_name='games', blank=True)
     categories = models.ManyToManyField('Category', related_name='games', blank=True)
+    refreshed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = GameQuerySet.as_manager()
 
     def __repr__(self):
         return f"<Game title:{self.title}>"
@@ -415,6 +678,16 @@ class Game(models.Model):
         average = total/count
         return round(average, 2)
 
+    def annotated_feedback(self):
+        '''
+        Returns the same average as calc_feedback, read from the annotations
+        added by GameQuerySet.with_feedback.
+        '''
+
+        if self.feedback_num == 0:
+            return None
+        return round(self.feedback_total/self.feedback_num, 2)
+
     def get_categories(self):
         categories = self.categories.all()
         str_list = []
@@ -435,4 +708,408 @@ class RSVP(models.Model):
 
     def __str__(self):
         invitee = self.invitee
-        return f"{invitee.first_name} {invitee.last_name}"
\ No newline at end of file
+        return f"{invitee.first_name} {invitee.last_name}"
+
+class InviteNotificationManager(models.Manager):
+    '''
+    Send log of invite emails. Invitees added to a GameNight are queued here
+    and mailed together by flush_invite_notifications once the GameNight has
+    had no invitee changes for INVITE_DEBOUNCE seconds. A contact is only
+    ever mailed once per GameNight, however often they are toggled.
+    '''
+
+    def queue(self, gamenight, contact):
+        notification, created = self.get_or_create(gamenight=gamenight, contact=contact)
+        if notification.sent_at is not None:
+            return
+        if not created:
+            notification.queued_at = timezone.now()
+            notification.save(update_fields=['queued_at'])
+        apply_on_commit(flush_invite_notifications, (gamenight.pk,), countdown=settings.INVITE_DEBOUNCE)
+
+    def unqueue(self, gamenight, contact):
+        self.filter(gamenight=gamenight, contact=contact, sent_at=None).delete()
+
+    def mark_sent(self, gamenight, contacts):
+        now = timezone.now()
+        self.bulk_create(
+            [InviteNotification(gamenight=gamenight, contact=contact, queued_at=now, sent_at=now) for contact in contacts],
+            ignore_conflicts=True
+        )
+
+    def flush(self, gamenight_pk):
+        '''
+        Mails every queued invitee of the GameNight in one email, unless an
+        invitee was queued within the debounce window. Returns the number of
+        invitees mailed.
+        '''
+
+        quiet_since = timezone.now() - timedelta(seconds=settings.INVITE_DEBOUNCE)
+        with transaction.atomic():
+            pending = self.filter(gamenight_id=gamenight_pk, sent_at=None)
+            if pending.filter(queued_at__gt=quiet_since).exists():
+                # a later flush was scheduled by that change
+                return 0
+            notifications = list(pending.select_related('contact').select_for_update(skip_locked=True))
+            if len(notifications) == 0:
+                return 0
+            self.filter(pk__in=[notification.pk for notification in notifications]).update(sent_at=timezone.now())
+            gamenight = GameNight.objects.get(pk=gamenight_pk)
+            gamenight.mail_update_invitees([notification.contact.email for notification in notifications])
+        return len(notifications)
+
+    def flush_due(self):
+        '''
+        Flushes every GameNight whose queued invitees have been quiet for the
+        debounce window, for flushes whose task never ran. Returns the number
+        of invitees mailed.
+        '''
+
+        quiet_since = timezone.now() - timedelta(seconds=settings.INVITE_DEBOUNCE)
+        gamenight_pks = (
+            self.filter(sent_at=None)
+                .values('gamenight_id')
+                .annotate(last_queued_at=Max('queued_at'))
+                .filter(last_queued_at__lte=quiet_since)
+                .values_list('gamenight_id', flat=True)
+        )
+        return sum(self.flush(gamenight_pk) for gamenight_pk in list(gamenight_pks))
+
+
+class InviteNotification(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['gamenight', 'contact'], name='unique-invite-notification')
+        ]
+
+    gamenight = models.ForeignKey('GameNight', on_delete=models.CASCADE, related_name='invite_notifications')
+    contact = models.ForeignKey('Contact', on_delete=models.CASCADE, related_name='invite_notifications')
+    queued_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = InviteNotificationManager()
+
+    def __repr__(self):
+        return f"<InviteNotification gamenight:{self.gamenight_id} contact:{self.contact_id}>"
+
+
+class UserStatsManager(models.Manager):
+
+    def for_user(self, user):
+        '''
+        Returns the stats dictionary for the given user. A stale row is served
+        as is while the refresh_user_stats task queued by mark_stale rebuilds
+        it, unless it was last built more than USER_STATS_MAX_STALENESS
+        seconds ago. Stats are only built inline in that case and when the
+        user has never had any.
+        '''
+
+        stats = self.filter(user=user).first()
+        if stats is None or stats.built_version == 0 or stats.is_expired():
+            stats = self.refresh(user)
+        return stats.get_data()
+
+    def refresh(self, user, full=False):
+        '''
+        Recomputes the sections of the given user's stats that were marked
+        stale and persists them. Everything is recomputed on the first build
+        or with full=True. The result is only written if no change came in
+        meanwhile; that change queued another refresh.
+        '''
+
+        from .serializers import UserStatsSerializer
+
+        stats, created = self.get_or_create(user=user)
+        version = stats.version
+        sections = stats.get_stale_sections()
+        serializer = UserStatsSerializer(user)
+        if full or stats.built_version == 0 or len(sections) == 0:
+            data = serializer.data
+        else:
+            data = stats.get_data()
+            for section in sections:
+                data[section] = getattr(serializer, f'get_{section}')(user)
+        stats.payload = json.dumps(data)
+        stats.built_version = version
+        stats.stale_sections = 0
+        self.filter(pk=stats.pk, version=version).update(
+            payload=stats.payload,
+            built_version=version,
+            stale_sections=0,
+            updated_at=timezone.now()
+        )
+        return stats
+
+    def refresh_stale(self, budget=None):
+        '''
+        Rebuilds up to budget stale rows, least recently built first, so stats
+        whose refresh task was lost don't stay stale. Returns the number of
+        rows rebuilt.
+        '''
+
+        budget = budget or settings.USER_STATS_SWEEP_BUDGET
+        stale = self.filter(built_version__lt=F('version')).select_related('user').order_by('updated_at')[:budget]
+        count = 0
+        for stats in stale:
+            self.refresh(stats.user)
+            count += 1
+        return count
+
+    def mark_stale(self, user_ids, sections=None):
+        '''
+        Flags the given sections (all of them by default) of the stats of the
+        given users as out of date and queues a rebuild once the current
+        transaction commits.
+        '''
+
+        from .tasks import refresh_user_stats
+
+        user_ids = {pk for pk in user_ids if pk is not None}
+        if len(user_ids) == 0:
+            return
+        mask = UserStats.section_mask(sections or UserStats.SECTIONS)
+        self.filter(user_id__in=user_ids).update(
+            version=F('version') + 1,
+            stale_sections=F('stale_sections').bitor(mask)
+        )
+        for user_id in user_ids:
+            apply_on_commit(refresh_user_stats, (user_id,))
+
+
+class UserStats(models.Model):
+    '''
+    Persisted copy of the dashboard stats served by DjoserUserSerializer. The
+    row is stale whenever version has moved past built_version, and
+    stale_sections holds one bit per SECTIONS entry that needs rebuilding.
+    '''
+
+    # the UserStatsSerializer fields, the order fixes their stale_sections bit
+    SECTIONS = (
+        'gamenights_finished',
+        'weekday_stats',
+        'most_common_players',
+        'most_played_games',
+        'least_played_games',
+        'games_not_played',
+        'highest_rated_games',
+        'most_played_categories',
+    )
+    # sections depending on finalized gamenights, their attendees and feedback
+    WEEKDAY_SECTIONS = ('gamenights_finished', 'weekday_stats')
+    # sections depending on contacts and what they attended
+    PLAYER_SECTIONS = ('most_common_players',)
+    # sections depending on owned games and how often they were played
+    PLAY_SECTIONS = ('most_played_games', 'least_played_games', 'games_not_played', 'most_played_categories')
+    # sections depending on owned games and their GameFeedback
+    RATING_SECTIONS = ('highest_rated_games',)
+    OWNED_GAME_SECTIONS = PLAY_SECTIONS + RATING_SECTIONS
+
+    user = models.OneToOneField('CustomUser', on_delete=models.CASCADE, related_name='stats')
+    # stored as text rather than a JSONField so that key order survives jsonb
+    payload = models.TextField(default='{}')
+    version = models.PositiveIntegerField(default=1)
+    built_version = models.PositiveIntegerField(default=0)
+    stale_sections = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserStatsManager()
+
+    def __repr__(self):
+        return f"<UserStats user:{self.user_id}>"
+
+    def __str__(self):
+        return f"Stats for {self.user}"
+
+    @classmethod
+    def section_mask(cls, sections):
+        return sum(1 << cls.SECTIONS.index(section) for section in set(sections))
+
+    def get_stale_sections(self):
+        return [section for index, section in enumerate(self.SECTIONS) if self.stale_sections & (1 << index)]
+
+    def is_stale(self):
+        return self.built_version < self.version
+
+    def is_expired(self):
+        max_age = timedelta(seconds=settings.USER_STATS_MAX_STALENESS)
+        return self.is_stale() and self.updated_at < timezone.now() - max_age
+
+    def get_data(self):
+        return json.loads(self.payload)
+
+
+class BGGThingManager(models.Manager):
+
+    def lookup(self, bgg_ids, max_age=None):
+        '''
+        Returns a dictionary mapping BGG IDs to their cached <item> XML,
+        leaving out entries older than max_age seconds when it is given.
+        '''
+
+        queryset = self.filter(bgg__in=bgg_ids)
+        if max_age is not None:
+            queryset = queryset.filter(fetched_at__gte=timezone.now() - timedelta(seconds=max_age))
+        return {thing.bgg: thing.get_xml() for thing in queryset}
+
+    def store(self, item_xmls):
+        '''
+        Caches the given dictionary of BGG IDs to <item> XML, replacing any
+        older entries.
+        '''
+
+        now = timezone.now()
+        existing = {thing.bgg: thing for thing in self.filter(bgg__in=item_xmls.keys())}
+        updated = []
+        created = []
+        for bgg, xml in item_xmls.items():
+            thing = existing.get(bgg) or BGGThing(bgg=bgg)
+            thing.data = zlib.compress(xml)
+            thing.fetched_at = now
+            if thing.pk is None:
+                created.append(thing)
+            else:
+                updated.append(thing)
+        self.bulk_update(updated, ['data', 'fetched_at'])
+        self.bulk_create(created, ignore_conflicts=True)
+
+    def expired(self, max_age=None):
+        if max_age is None:
+            max_age = settings.BGG_CACHE_TTL
+        return self.filter(fetched_at__lt=timezone.now() - timedelta(seconds=max_age))
+
+
+class BGGThing(models.Model):
+    '''
+    Local cache of BGG thing responses, one zlib-compressed <item> per BGG ID.
+    '''
+
+    bgg = models.IntegerField(unique=True)
+    data = models.BinaryField()
+    fetched_at = models.DateTimeField(db_index=True)
+
+    objects = BGGThingManager()
+
+    def __repr__(self):
+        return f"<BGGThing bgg:{self.bgg}>"
+
+    def __str__(self):
+        return f"{self.bgg}"
+
+    def get_xml(self):
+        return zlib.decompress(self.data)
+
+
+class CollectionImportQuerySet(models.QuerySet):
+
+    def stalled(self):
+        '''
+        Jobs that haven't made progress for COLLECTION_IMPORT_TIMEOUT seconds
+        without finishing, because their task was lost or its worker died.
+        '''
+
+        cutoff = timezone.now() - timedelta(seconds=settings.COLLECTION_IMPORT_TIMEOUT)
+        return self.filter(status__in=['Pending', 'Running'], updated_at__lt=cutoff)
+
+
+class CollectionImport(models.Model):
+    '''
+    Background job adding a BGG collection, or a list of BGG IDs, to a user's
+    library or wishlist. Progress is polled through its counters.
+    '''
+
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Running', 'Running'),
+        ('Done', 'Done'),
+        ('Failed', 'Failed')
+    ]
+
+    user = models.ForeignKey('CustomUser', on_delete=models.CASCADE, related_name='collection_imports')
+    username = models.CharField(max_length=100, null=True, blank=True)
+    bgg_ids = models.JSONField(default=list, blank=True)
+    wishlist = models.BooleanField(default=False)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default='Pending')
+    total = models.PositiveIntegerField(default=0)
+    fetched = models.PositiveIntegerField(default=0)
+    new_games = models.PositiveIntegerField(default=0)
+    linked = models.PositiveIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = CollectionImportQuerySet.as_manager()
+
+    def __repr__(self):
+        return f"<CollectionImport pk:{self.pk} status:{self.status}>"
+
+    def __str__(self):
+        return f"{self.user} import {self.pk}"
+
+
+class OutboxQuerySet(models.QuerySet):
+
+    def due(self):
+        return self.filter(status='Pending', next_attempt_at__lte=timezone.now()).order_by('next_attempt_at', 'pk')
+
+    def stats(self):
+        '''
+        Returns the backlog size, the age in seconds of the oldest pending
+        email (the lag), how many emails failed for good and how many were
+        sent in the last hour.
+        '''
+
+        now = timezone.now()
+        pending = self.filter(status='Pending')
+        oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+        return {
+            'pending': pending.count(),
+            'lag': (now - oldest).total_seconds() if oldest else 0.0,
+            'failed': self.filter(status='Failed').count(),
+            'sent_last_hour': self.filter(status='Sent', sent_at__gte=now - timedelta(hours=1)).count(),
+        }
+
+    def prune(self):
+        '''
+        Deletes the emails sent more than OUTBOX_RETENTION seconds ago.
+        Returns the number deleted.
+        '''
+
+        deleted, _ = self.filter(status='Sent', sent_at__lt=timezone.now() - timedelta(seconds=settings.OUTBOX_RETENTION)).delete()
+        return deleted
+
+
+class Outbox(models.Model):
+    '''
+    Email written in the same transaction as the change it reports, and
+    delivered by the drain_outbox task (see api.mail).
+    '''
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox-due'),
+        ]
+
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Sent', 'Sent'),
+        ('Failed', 'Failed')
+    ]
+
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    recipient_list = models.JSONField(default=list)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default='Pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    objects = OutboxQuerySet.as_manager()
+
+    def __repr__(self):
+        return f"<Outbox pk:{self.pk} status:{self.status}>"
+
+    def __str__(self):
+        return f"{self.subject}"
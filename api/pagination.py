@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class GameNightCursorPagination(CursorPagination):
+    '''
+    Pages through a user's GameNights from the most recent date backwards.
+    '''
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-date', '-pk')
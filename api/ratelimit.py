@@ -0,0 +1,154 @@
+import logging
+import math
+import time
+from redis.exceptions import RedisError
+from django.conf import settings
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    pass
+
+
+class TokenBucket:
+    '''
+    Token bucket kept in a Redis hash, so every process talking to Redis
+    shares the same budget. The bucket refills at rate tokens per second up
+    to burst tokens, and each acquire takes one token, sleeping until one is
+    available for at most max_wait seconds.
+
+    Besides the per-process metrics, the counters are added up across
+    processes in the key:metrics hash, read by shared_metrics().
+
+    Works against any client with the redis-py interface, fakeredis included.
+    '''
+
+    def __init__(self, redis, key, rate, burst, max_wait):
+        self.redis = redis
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.metrics = {
+            'acquired': 0,
+            'waits': 0,
+            'rejections': 0,
+            'errors': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+        }
+
+    def __repr__(self):
+        return f"<TokenBucket key:{self.key} rate:{self.rate} burst:{self.burst}>"
+
+    @property
+    def metrics_key(self):
+        return f"{self.key}:metrics"
+
+    def take(self):
+        '''
+        Takes a token if one is available. Returns 0 on success, otherwise the
+        number of seconds until the next token.
+        '''
+
+        def update(pipe):
+            seconds, microseconds = pipe.time()
+            now = seconds + microseconds / 1000000
+            tokens, updated = pipe.hmget(self.key, 'tokens', 'updated')
+            if tokens is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, float(tokens) + (now - float(updated)) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            pipe.multi()
+            pipe.hset(self.key, mapping={'tokens': tokens, 'updated': now})
+            pipe.expire(self.key, math.ceil(self.burst / self.rate) + 1)
+            return wait
+
+        return self.redis.transaction(update, self.key, value_from_callable=True)
+
+    def acquire(self):
+        '''
+        Blocks until a token is taken. Raises RateLimited if that would take
+        longer than max_wait. If Redis is unreachable the call is let through.
+        '''
+
+        waited = 0.0
+        while True:
+            # redis-py's transaction() retries by itself when another process
+            # updates the bucket first
+            try:
+                wait = self.take()
+            except RedisError as error:
+                self.metrics['errors'] += 1
+                logger.warning('Rate limiter unavailable, not limiting: %s', error)
+                return
+            if wait == 0:
+                break
+            if waited + wait > self.max_wait:
+                self.metrics['rejections'] += 1
+                self.publish(rejections=1)
+                logger.warning('No %s token within %ss, rejected after waiting %.3fs', self.key, self.max_wait, waited)
+                raise RateLimited(f"No {self.key} token within {self.max_wait}s")
+            time.sleep(wait)
+            waited += wait
+        self.metrics['acquired'] += 1
+        if waited:
+            self.metrics['waits'] += 1
+            self.metrics['total_wait'] += waited
+            self.metrics['max_wait'] = max(self.metrics['max_wait'], waited)
+            logger.info('Waited %.3fs for a %s token', waited, self.key)
+            self.publish(acquired=1, waits=1, total_wait=waited)
+        else:
+            self.publish(acquired=1)
+
+    def publish(self, total_wait=0.0, **counts):
+        '''
+        Adds to the shared counters. Losing an update when Redis fails is
+        fine, so errors are only logged.
+        '''
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for name, count in counts.items():
+                pipe.hincrby(self.metrics_key, name, count)
+            if total_wait:
+                pipe.hincrbyfloat(self.metrics_key, 'total_wait', total_wait)
+            pipe.execute()
+        except RedisError as error:
+            logger.warning('Could not publish %s metrics: %s', self.key, error)
+
+    def shared_metrics(self):
+        '''
+        Returns the counters added up by every process using this bucket.
+        '''
+
+        values = self.redis.hgetall(self.metrics_key)
+        metrics = {name.decode(): float(value) for name, value in values.items()}
+        for name in ('acquired', 'waits', 'rejections'):
+            metrics[name] = int(metrics.get(name, 0))
+        metrics.setdefault('total_wait', 0.0)
+        return metrics
+
+
+def bgg_limiter():
+    '''
+    Returns the token bucket shared by all BGG calls, or None when
+    BGG_RATE_LIMIT is 0.
+    '''
+
+    if not settings.BGG_RATE_LIMIT:
+        return None
+    return TokenBucket(
+        get_redis(),
+        'bgg-rate-limit',
+        rate=settings.BGG_RATE_LIMIT,
+        burst=settings.BGG_RATE_BURST,
+        max_wait=settings.BGG_RATE_MAX_WAIT,
+    )
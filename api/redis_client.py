@@ -0,0 +1,15 @@
+import redis
+from django.conf import settings
+
+_redis = None
+
+
+def get_redis():
+    '''
+    Returns the process-wide Redis client, creating it on first use.
+    '''
+
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.REDIS_URL)
+    return _redis
@@ -1,13 +1,31 @@
 from rest_framework import serializers
-from .models import Game, CustomUser, Tag, GameNight, Contact, Voting, GeneralFeedback, GameFeedback, RSVP, Category
+from .models import Game, CustomUser, Tag, GameNight, Contact, Voting, GeneralFeedback, GameFeedback, RSVP, Category, UserStats, CollectionImport, session_length
 from djoser.serializers import UserCreatePasswordRetypeSerializer
 from drf_writable_nested import WritableNestedModelSerializer
 from django.db.models.query import QuerySet
+from django.db.models import Manager, Count, Max
 from calendar import day_name
 from datetime import date
 import random
 
 
+class GameListListSerializer(serializers.ListSerializer):
+    '''
+    Annotates the requesting user's average feedback and prefetches the
+    categories of every game in the list.
+    '''
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, Manager) else data
+        if isinstance(iterable, QuerySet):
+            user = self.context['request'].user
+            if user.is_authenticated and 'feedback_num' not in iterable.query.annotations:
+                iterable = iterable.with_feedback(user)
+            if 'categories' not in iterable._prefetch_related_lookups:
+                iterable = iterable.prefetch_related('categories')
+        return super().to_representation(iterable)
+
+
 class GameListSerializer(serializers.ModelSerializer):
     categories = serializers.StringRelatedField(many=True)
     avg_feedback = serializers.SerializerMethodField()
@@ -26,10 +44,13 @@ class GameListSerializer(serializers.ModelSerializer):
             'categories',
             'avg_feedback',
         )
+        list_serializer_class = GameListListSerializer
 
     def get_avg_feedback(self, obj):
         user = self.context['request'].user
         if user.is_authenticated:
+            if hasattr(obj, 'feedback_num'):
+                return obj.annotated_feedback()
             return obj.calc_feedback(user)
         return None
 
@@ -89,6 +110,35 @@ class GameDetailSerializer(serializers.ModelSerializer):
         return None
 
 
+def load_favorite_games(context, contacts):
+    '''
+    Loads the favorite games of the given contacts in bulk and caches them in
+    the serializer context, keyed by contact pk.
+    '''
+    favorites = context.setdefault('favorite_games', {})
+    missing = [contact.pk for contact in contacts if contact.pk not in favorites]
+    if len(missing) > 0:
+        found = Contact.objects.filter(pk__in=missing).favorite_games()
+        for pk in missing:
+            favorites[pk] = found.get(pk, [])
+    return favorites
+
+
+class ContactListSerializer(serializers.ListSerializer):
+    '''
+    Loads the favorite games and attendance rates of every contact in the list
+    up front instead of once per contact.
+    '''
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, Manager) else data
+        if isinstance(iterable, QuerySet) and 'attend_rate' not in iterable.query.annotations:
+            iterable = iterable.with_attendance()
+        contacts = list(iterable)
+        load_favorite_games(self.context, contacts)
+        return super().to_representation(contacts)
+
+
 class ContactSerializer(serializers.ModelSerializer):
     attendance_rate = serializers.SerializerMethodField()
     favorite_games = serializers.SerializerMethodField()
@@ -103,11 +153,15 @@ class ContactSerializer(serializers.ModelSerializer):
             'attendance_rate',
             'favorite_games',
         )
+        list_serializer_class = ContactListSerializer
 
     def get_attendance_rate(self, obj):
         return obj.attend_percent()
 
     def get_favorite_games(self, obj):
+        favorites = self.context.get('favorite_games', {})
+        if obj.pk in favorites:
+            return favorites[obj.pk]
         return obj.fav_games()
 
 
@@ -159,9 +213,13 @@ class GameForGameNightSerializer(serializers.ModelSerializer):
         serialized_instance = self.parent.parent.instance
         if isinstance(serialized_instance, QuerySet):
             return None
+        if serialized_instance is None:
+            return 0
         gamenight = serialized_instance
-        votes = obj.tally_votes(gamenight)
-        return votes
+        tallies = self.context.get('vote_tallies', {}).get(getattr(gamenight, 'pk', None))
+        if tallies is None:
+            return obj.tally_votes(gamenight)
+        return tallies.get(obj.pk, 0)
 
     # def get_feedback(self, obj):
     #     serialized_instance = self.parent.parent.instance
@@ -187,14 +245,37 @@ class ContactForGameNightSerializer(serializers.ModelSerializer):
             'favorite_games',
             'attendance_rate',
         )
+        list_serializer_class = ContactListSerializer
 
     def get_favorite_games(self, obj):
+        favorites = self.context.get('favorite_games', {})
+        if obj.pk in favorites:
+            return favorites[obj.pk]
         return obj.fav_games()
 
     def get_attendance_rate(self, obj):
         return obj.attend_percent()
 
 
+class GameNightListSerializer(serializers.ListSerializer):
+    '''
+    Applies the GameNight prefetch plan to querysets that don't have one yet
+    and loads the favorite games of every invitee in the list at once.
+    '''
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, Manager) else data
+        if isinstance(iterable, QuerySet) and len(iterable._prefetch_related_lookups) == 0:
+            iterable = iterable.with_related()
+        gamenights = list(iterable)
+        contacts = []
+        for gamenight in gamenights:
+            contacts.extend(gamenight.invitees.all())
+            contacts.extend(gamenight.attendees.all())
+        load_favorite_games(self.context, contacts)
+        return super().to_representation(gamenights)
+
+
 class GameNightSerializer(serializers.ModelSerializer):
     user = UserNestedSerializer(read_only=True)
     invitees = serializers.SerializerMethodField()
@@ -224,31 +305,31 @@ class GameNightSerializer(serializers.ModelSerializer):
             'comments',
             # 'feedback',
         )
+        list_serializer_class = GameNightListSerializer
 
     # def get_feedback(self, obj):
     #     return obj.calc_feedback()
 
+    def to_representation(self, instance):
+        # tally every option's votes and load every invitee's favorite games
+        # (attendees are a subset of invitees) up front for the nested fields
+        if instance is self.instance:
+            self.context.setdefault('vote_tallies', {})[instance.pk] = instance.vote_tallies()
+            load_favorite_games(self.context, instance.invitees.all())
+        return super().to_representation(instance)
+
     def get_invitees(self, obj):
-        invitees = obj.invitees.all()
-        rsvps = obj.rsvps.all()
-        rsvp_list = []
-        inv_list = []
-        for rsvp in rsvps:
-            rsvp_list.append(rsvp.invitee)
-        for contact in invitees:
-            if contact in rsvp_list:
-                continue
-            inv_list.append(
-                {
-                    'pk': contact.pk,
-                    'first_name': contact.first_name,
-                    'last_name': contact.last_name,
-                    'email': contact.email,
-                    'favorite_games': contact.fav_games(),
-                    'attendance_rate': contact.attend_percent()
-                }
-            )
-        return inv_list
+        '''
+        Returns the invitees who haven't RSVPed yet. Prefetched invitees are
+        filtered against a set of RSVPed contact pks; otherwise the RSVPed
+        contacts are excluded in SQL.
+        '''
+        if 'invitees' in getattr(obj, '_prefetched_objects_cache', {}):
+            rsvped = {rsvp.invitee_id for rsvp in obj.rsvps.all()}
+            invitees = [contact for contact in obj.invitees.all() if contact.pk not in rsvped]
+        else:
+            invitees = obj.invitees.exclude(rsvps__gamenight=obj).with_attendance()
+        return ContactForGameNightSerializer(invitees, many=True, context=self.context).data
 
     def get_comments(self, obj):
         fbacks = obj.generalfeedback.all()
@@ -269,6 +350,28 @@ class GameNightSerializer(serializers.ModelSerializer):
         return comments
 
 
+class GameNightSummarySerializer(serializers.ModelSerializer):
+    invitee_num = serializers.IntegerField(read_only=True)
+    attendee_num = serializers.IntegerField(read_only=True)
+    option_num = serializers.IntegerField(read_only=True)
+    game_num = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = GameNight
+        fields = (
+            'pk',
+            'rid',
+            'date',
+            'start_time',
+            'status',
+            'location',
+            'invitee_num',
+            'attendee_num',
+            'option_num',
+            'game_num',
+        )
+
+
 class GameNightCreateSerializer(serializers.ModelSerializer):
     user = UserNestedSerializer(read_only=True)
 
@@ -289,11 +392,38 @@ class GameNightCreateSerializer(serializers.ModelSerializer):
         )
 
 
-class DjoserUserSerializer(serializers.ModelSerializer):
-    games = GameListSerializer(many=True, read_only=True)
-    wishlist = GameListSerializer(many=True, read_only=True)
-    contacts = ContactSerializer(many=True, read_only=True)
-    gamenights = GameNightSerializer(many=True, read_only=True)
+class CollectionImportSerializer(serializers.ModelSerializer):
+    bgg_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+
+    class Meta:
+        model = CollectionImport
+        fields = (
+            'pk',
+            'username',
+            'bgg_ids',
+            'wishlist',
+            'status',
+            'total',
+            'fetched',
+            'new_games',
+            'linked',
+            'error',
+            'created_at',
+            'finished_at',
+        )
+        read_only_fields = ('status', 'total', 'fetched', 'new_games', 'linked', 'error', 'created_at', 'finished_at')
+
+    def validate(self, data):
+        if bool(data.get('username')) == bool(data.get('bgg_ids')):
+            raise serializers.ValidationError('Give either a BGG username or a list of bgg_ids.')
+        return data
+
+
+class UserStatsSerializer(serializers.ModelSerializer):
+    '''
+    Computes the dashboard stats for a user. The output is persisted in the
+    UserStats table and read back by DjoserUserSerializer.
+    '''
     gamenights_finished = serializers.SerializerMethodField()
     weekday_stats = serializers.SerializerMethodField()
     most_common_players = serializers.SerializerMethodField()
@@ -302,17 +432,10 @@ class DjoserUserSerializer(serializers.ModelSerializer):
     games_not_played = serializers.SerializerMethodField()
     highest_rated_games = serializers.SerializerMethodField()
     most_played_categories = serializers.SerializerMethodField()
+
     class Meta:
         model = CustomUser
         fields = (
-            'pk',
-            'username',
-            'email',
-            'avatar',
-            'games',
-            'wishlist',
-            'contacts',
-            'gamenights',
             'gamenights_finished',
             'weekday_stats',
             'most_common_players',
@@ -328,9 +451,8 @@ class DjoserUserSerializer(serializers.ModelSerializer):
 
     # methods for weekday_stats field
     def get_weekday_stats(self, obj):
-        user = obj
-        gamenight_dict = self.build_week_dict(user)
-        days = gamenight_dict.keys()
+        days = list(day_name)
+        gamenight_dict = self.build_week_dict(obj, days)
         stats_dict = {
             'avg_overall_feedback': {},
             'avg_attend_ratio': {},
@@ -341,125 +463,69 @@ class DjoserUserSerializer(serializers.ModelSerializer):
         }
         for day in days:
             gamenights = gamenight_dict[day]
-            stats_dict['avg_overall_feedback'][day] = self.days_avg_overall(gamenights)
-            stats_dict['avg_attend_ratio'][day] = self.days_avg_attend(gamenights)
-            stats_dict['avg_session_len'][day] = self.days_avg_session_len(gamenights)
-            stats_dict['avg_game_num'][day] = self.days_avg_game_num(gamenights)
-            stats_dict['avg_player_num'][day] = self.days_avg_player_num(gamenights)
+            overall = []
+            attendance = []
+            session_lens = []
+            game_nums = []
+            player_nums = []
+            for night in gamenights:
+                if night['overall_num'] > 0:
+                    overall.append(round(night['overall_total']/night['overall_num'], 2))
+                if night['invitee_num'] > 0:
+                    attendance.append(round(night['attendee_num']/night['invitee_num'], 2))
+                session_len = session_length(night['date'], night['start_time'], night['end_time'])
+                if session_len is not None:
+                    session_lens.append(session_len)
+                if night['game_num'] > 0:
+                    game_nums.append(night['game_num'])
+                if night['attendee_num'] > 0:
+                    player_nums.append(night['attendee_num'])
+            stats_dict['avg_overall_feedback'][day] = self.calc_average(overall)
+            attend_avg = self.calc_average(attendance, places=None)
+            stats_dict['avg_attend_ratio'][day] = None if attend_avg is None else round(attend_avg*100, 2)
+            stats_dict['avg_session_len'][day] = self.calc_average(session_lens)
+            stats_dict['avg_game_num'][day] = self.calc_average(game_nums)
+            stats_dict['avg_player_num'][day] = self.calc_average(player_nums)
             stats_dict['sessions_num'][day] = len(gamenights)
         return stats_dict
 
-    def build_week_dict(self, user):
+    def build_week_dict(self, user, days):
         '''
         Builds a dictionary where the keys are the names for the days of the
-        week and the values are the GameNights that occurred on that day.
+        week and the values are the finalized GameNights that occurred on that
+        day, with their counts and feedback totals aggregated in one query.
         '''
-        gamenights = user.gamenights.filter(status="Finalized")
+        gamenights = user.gamenights.filter(status="Finalized").with_stat_counts().order_by('pk').values(
+            'weekday',
+            'date',
+            'start_time',
+            'end_time',
+            'attendee_num',
+            'invitee_num',
+            'game_num',
+            'overall_total',
+            'overall_num',
+        )
         game_days = {}
-        days = list(day_name)
         for day in days:
             game_days[day] = []
         for night in gamenights:
-            day = night.date.weekday()
-            game_days[days[day]].append(night)
+            game_days[days[night['weekday'] - 1]].append(night)
         return game_days
 
-    def days_avg_overall(self, gamenights):
-        '''
-        Takes a list of GameNight objects and returns the average overall
-        rating among them.
-        '''
-        gamenight_num = len(gamenights)
-        total = 0
-        for gamenight in gamenights:
-            overall = gamenight.calc_avg_overall()
-            if overall == None:
-                gamenight_num -= 1
-                continue
-            total += overall
-        if gamenight_num == 0:
-            average = None
-        else:
-            average = round(total/gamenight_num, 2)
-        return average
-
-    def days_avg_attend(self, gamenights):
+    def calc_average(self, values, places=2):
         '''
-        Takes a list of GameNight objects and returns the average attendance
-        ratio among them as a percentage.
+        Returns the average of the given values, or None if there are none.
         '''
-        gamenight_num = len(gamenights)
-        total = 0
-        for gamenight in gamenights:
-            attendees_num = len(gamenight.attendees.all())
-            invitees_num = len(gamenight.invitees.all())
-            if invitees_num == None:
-                gamenight_num -= 1
-                continue
-            attendance = round(attendees_num/invitees_num, 2)
-            total += attendance
-        if gamenight_num == 0:
+        if len(values) == 0:
             return None
-        else:
-            average = round((total/gamenight_num)*100, 2)
-        return average
-
-    def days_avg_session_len(self, gamenights):
-        '''
-        Takes a list of GameNight objects and returns the average session
-        length (in minutes) among them.
-        '''
-        gamenight_num = len(gamenights)
         total = 0
-        for gamenight in gamenights:
-            session_len = gamenight.calc_session_len()
-            if session_len == None:
-                gamenight_num -= 1
-                continue
-            total += session_len
-        if gamenight_num == 0:
-            average = None
-        else:
-            average = round(total/gamenight_num, 2)
-        return average
-
-    def days_avg_game_num(self, gamenights):
-        '''
-        Takes a list of GameNight objects and returns the average number of
-        unique games played among them.
-        '''
-        gamenight_num = len(gamenights)
-        total = 0
-        for gamenight in gamenights:
-            game_num = len(gamenight.games.all())
-            if game_num == 0:
-                gamenight_num -=1
-                continue
-            total += game_num
-        if gamenight_num == 0:
-            average = None
-        else:
-            average = round(total/gamenight_num, 2)
-        return average
-
-    def days_avg_player_num(self, gamenights):
-        '''
-        Takes a list of GameNight objects and returns the average number of
-        players among them.
-        '''
-        gamenight_num = len(gamenights)
-        total = 0
-        for gamenight in gamenights:
-            player_num = len(gamenight.attendees.all())
-            if player_num ==0:
-                gamenight_num -=1
-                continue
-            total += player_num
-        if gamenight_num == 0:
-            average = None
-        else:
-            average = round(total/gamenight_num, 2)
-        return average
+        for value in values:
+            total += value
+        average = total/len(values)
+        if places is None:
+            return average
+        return round(average, places)
 
     def get_most_common_players(self, obj):
         contacts = obj.contacts.all()
@@ -515,8 +581,7 @@ class DjoserUserSerializer(serializers.ModelSerializer):
         return return_list
 
     def get_most_played_games(self, obj):
-        games = obj.games.all()
-        freq_dict, other_data, games_sort = self.sort_games_by_play_num(games)
+        freq_dict, other_data, games_sort = self.sort_games_by_play_num(obj)
         played_dict = {k:v for k,v in freq_dict.items() if v != 0}
         for game in games_sort.copy():
             if game not in played_dict:
@@ -555,17 +620,13 @@ class DjoserUserSerializer(serializers.ModelSerializer):
 
     def get_least_played_games(self, obj):
         return_list = []
-        games = obj.games.all()
-        freq_dict, other_data, games_sort = self.sort_games_by_play_num(games)
-        if len(games) < 5:
+        play_index = self.get_play_index(obj)
+        freq_dict, other_data, games_sort = self.sort_games_by_play_num(obj)
+        if play_index['game_num'] < 5:
             for game in games_sort:
                 if freq_dict[game] == 0:
                     continue
-                gamenights = games.filter(title=game)[0].gamenights.all()
-                most_recent = gamenights[0].date
-                for gamenight in gamenights:
-                    if gamenight.date > most_recent:
-                        most_recent = gamenight.date
+                most_recent = play_index['last_played'][game]
                 game_data = other_data[game]
                 return_list.append(
                     {
@@ -587,11 +648,7 @@ class DjoserUserSerializer(serializers.ModelSerializer):
                     if index == len(games_sort):
                         break
                     continue
-                gamenights = games.filter(title=name)[0].gamenights.all()
-                most_recent = gamenights[0].date
-                for gamenight in gamenights:
-                    if gamenight.date > most_recent:
-                        most_recent = gamenight.date
+                most_recent = play_index['last_played'][name]
                 game_data = other_data[name]
                 return_list.append(
                     {
@@ -612,8 +669,7 @@ class DjoserUserSerializer(serializers.ModelSerializer):
 
     def get_games_not_played(self,obj):
         final_list = []
-        games = obj.games.all()
-        freq_dict, other_data, games_sort = self.sort_games_by_play_num(games)
+        freq_dict, other_data, games_sort = self.sort_games_by_play_num(obj)
         zeroes = [k for k,v in freq_dict.items() if v == 0]
         for game in zeroes:
             game_data = other_data[game]
@@ -627,32 +683,56 @@ class DjoserUserSerializer(serializers.ModelSerializer):
                     'categories': game_data['categories']
                 }
             )
-        if len(final_list) < 6:
-            return final_list
-        return random.sample(final_list, 5)
+        return final_list
 
-    def sort_games_by_play_num(self, games):
-        other_data_dict = {}
-        freq_dict = {}
+    def sort_games_by_play_num(self, obj):
+        play_index = self.get_play_index(obj)
+        freq_dict = play_index['freq']
+        games_sort = sorted(freq_dict, key=freq_dict.__getitem__)
+        return freq_dict, play_index['other_data'], games_sort
+
+    def get_play_index(self, obj):
+        '''
+        Builds the play counts, categories and last played dates of the user's
+        games in two queries. The index is kept in the serializer context so
+        every stats field shares it.
+        '''
+        index_cache = self.context.setdefault('play_index', {})
+        if obj.pk in index_cache:
+            return index_cache[obj.pk]
+        games = obj.games.annotate(
+            play_num=Count('gamenights', distinct=True),
+            last_played=Max('gamenights__date')
+        ).prefetch_related('categories')
+        play_index = {
+            'game_num': 0,
+            'freq': {},
+            'other_data': {},
+            'last_played': {},
+            'game_categories': [],
+        }
         for game in games:
-            gamenights = len(game.gamenights.all())
-            freq_dict[str(game)] = gamenights
-            other_data_dict[str(game)] = {
+            categories = game.get_categories()
+            play_index['game_num'] += 1
+            play_index['freq'][str(game)] = game.play_num
+            play_index['other_data'][str(game)] = {
                 'bgg': game.bgg,
                 'pub_year': game.pub_year,
                 'image': game.image,
-                'categories': game.get_categories()
+                'categories': categories
             }
-        games_sort = sorted(freq_dict, key=freq_dict.__getitem__)
-        return freq_dict, other_data_dict, games_sort
+            play_index['last_played'].setdefault(str(game), game.last_played)
+            play_index['game_categories'].append((str(game), categories))
+        index_cache[obj.pk] = play_index
+        return play_index
 
     def get_highest_rated_games(self, obj):
-        games = obj.games.all()
+        games = obj.games.with_feedback(obj)
         other_data = {}
         rating_dict = {}
         final_list = []
         for game in games:
-            avg_rating = game.calc_feedback(obj)
+            avg_rating = game.annotated_feedback()
             if avg_rating is None:
                 continue
             rating_dict[str(game)] = avg_rating
@@ -694,15 +774,14 @@ class DjoserUserSerializer(serializers.ModelSerializer):
 
     def get_most_played_categories(self, obj):
         categories = Category.objects.all()
-        games = obj.games.all()
-        freq_dict, other, g_sort = self.sort_games_by_play_num(games)
+        play_index = self.get_play_index(obj)
+        freq_dict = play_index['freq']
         count_dict = {}
         for category in categories:
             count_dict[category.name] = 0
-        for game in games:
-            game_cats = game.categories.all()
+        for game, game_cats in play_index['game_categories']:
             for cat in game_cats:
-                count_dict[cat.name] += freq_dict[str(game)]
+                count_dict[cat] += freq_dict[game]
         played_dict = {k:v for k,v in count_dict.items() if v != 0}
         total = sum(played_dict.values())
         sorted_cats = sorted(played_dict, key=played_dict.__getitem__)
@@ -734,6 +813,78 @@ class DjoserUserSerializer(serializers.ModelSerializer):
         return final_list
 
 
+class DjoserUserSerializer(serializers.ModelSerializer):
+    games = GameListSerializer(many=True, read_only=True)
+    wishlist = GameListSerializer(many=True, read_only=True)
+    contacts = ContactSerializer(many=True, read_only=True)
+    gamenights = GameNightSerializer(many=True, read_only=True)
+    gamenights_finished = serializers.SerializerMethodField()
+    weekday_stats = serializers.SerializerMethodField()
+    most_common_players = serializers.SerializerMethodField()
+    most_played_games = serializers.SerializerMethodField()
+    least_played_games = serializers.SerializerMethodField()
+    games_not_played = serializers.SerializerMethodField()
+    highest_rated_games = serializers.SerializerMethodField()
+    most_played_categories = serializers.SerializerMethodField()
+    class Meta:
+        model = CustomUser
+        fields = (
+            'pk',
+            'username',
+            'email',
+            'avatar',
+            'games',
+            'wishlist',
+            'contacts',
+            'gamenights',
+            'gamenights_finished',
+            'weekday_stats',
+            'most_common_players',
+            'most_played_games',
+            'least_played_games',
+            'games_not_played',
+            'highest_rated_games',
+            'most_played_categories',
+        )
+
+    def get_user_stats(self, obj):
+        '''
+        Returns the persisted stats for the user, only loading them once per
+        serialization.
+        '''
+        stats_cache = self.context.setdefault('user_stats', {})
+        if obj.pk not in stats_cache:
+            stats_cache[obj.pk] = UserStats.objects.for_user(obj)
+        return stats_cache[obj.pk]
+
+    def get_gamenights_finished(self, obj):
+        return self.get_user_stats(obj)['gamenights_finished']
+
+    def get_weekday_stats(self, obj):
+        return self.get_user_stats(obj)['weekday_stats']
+
+    def get_most_common_players(self, obj):
+        return self.get_user_stats(obj)['most_common_players']
+
+    def get_most_played_games(self, obj):
+        return self.get_user_stats(obj)['most_played_games']
+
+    def get_least_played_games(self, obj):
+        return self.get_user_stats(obj)['least_played_games']
+
+    def get_games_not_played(self, obj):
+        final_list = self.get_user_stats(obj)['games_not_played']
+        if len(final_list) < 6:
+            return final_list
+        return random.sample(final_list, 5)
+
+    def get_highest_rated_games(self, obj):
+        return self.get_user_stats(obj)['highest_rated_games']
+
+    def get_most_played_categories(self, obj):
+        return self.get_user_stats(obj)['most_played_categories']
+
+
 class DjoserRegistrationSerializer(UserCreatePasswordRetypeSerializer):
     class Meta(UserCreatePasswordRetypeSerializer.Meta):
         fields = (
@@ -0,0 +1,125 @@
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from .models import GameNight, Game, Category, Contact, GameFeedback, GeneralFeedback, UserStats
+
+# GameNight fields that the weekday stats depend on
+TRACKED_GAMENIGHT_FIELDS = ('status', 'date', 'start_time', 'end_time')
+
+
+def gamenight_snapshot(gamenight):
+    return tuple(getattr(gamenight, field) for field in TRACKED_GAMENIGHT_FIELDS)
+
+
+def game_owner_ids(game_pks):
+    return Game.owners.through.objects.filter(game_id__in=game_pks).values_list('customuser_id', flat=True)
+
+
+def gamenight_user_ids(gamenight_pks):
+    return GameNight.objects.filter(pk__in=gamenight_pks).values_list('user_id', flat=True)
+
+
+# UserStats sections affected by changes to a user's gamenights and contacts
+GAMENIGHT_SECTIONS = UserStats.WEEKDAY_SECTIONS + UserStats.PLAY_SECTIONS
+CONTACT_SECTIONS = UserStats.WEEKDAY_SECTIONS + UserStats.PLAYER_SECTIONS
+
+
+@receiver(post_init, sender=GameNight)
+def remember_gamenight_state(sender, instance, **kwargs):
+    instance._stats_snapshot = gamenight_snapshot(instance)
+
+
+@receiver(post_save, sender=GameNight)
+def gamenight_saved(sender, instance, created, **kwargs):
+    snapshot = gamenight_snapshot(instance)
+    if created or snapshot != instance._stats_snapshot:
+        UserStats.objects.mark_stale([instance.user_id], GAMENIGHT_SECTIONS)
+    instance._stats_snapshot = snapshot
+
+
+@receiver(pre_delete, sender=GameNight)
+def gamenight_deleted(sender, instance, **kwargs):
+    UserStats.objects.mark_stale([instance.user_id])
+    UserStats.objects.mark_stale(game_owner_ids(instance.games.values_list('pk', flat=True)), UserStats.OWNED_GAME_SECTIONS)
+
+
+@receiver(m2m_changed, sender=GameNight.attendees.through)
+@receiver(m2m_changed, sender=GameNight.invitees.through)
+def gamenight_contacts_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''
+    Contacts and gamenights always belong to the same user, so only the
+    user of the instance is affected, even when the relation is cleared.
+    '''
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    UserStats.objects.mark_stale([instance.user_id], CONTACT_SECTIONS)
+
+
+@receiver(m2m_changed, sender=GameNight.games.through)
+def gamenight_games_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''
+    Play counts are shared by every owner of a game, so all of them need
+    their stats rebuilt. A clear has no pk_set, the related pks are read
+    before it instead.
+    '''
+    if action == 'pre_clear':
+        related = instance.gamenights if reverse else instance.games
+        instance._stats_cleared_pks = set(related.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_stats_cleared_pks', set())
+    if reverse:
+        UserStats.objects.mark_stale(game_owner_ids([instance.pk]), UserStats.OWNED_GAME_SECTIONS)
+        UserStats.objects.mark_stale(gamenight_user_ids(pk_set), GAMENIGHT_SECTIONS)
+    else:
+        UserStats.objects.mark_stale([instance.user_id], GAMENIGHT_SECTIONS)
+        UserStats.objects.mark_stale(game_owner_ids(pk_set), UserStats.OWNED_GAME_SECTIONS)
+
+
+@receiver(m2m_changed, sender=Game.owners.through)
+def game_owners_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._stats_cleared_pks = set(instance.owners.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        UserStats.objects.mark_stale([instance.pk], UserStats.OWNED_GAME_SECTIONS)
+    elif action == 'post_clear':
+        UserStats.objects.mark_stale(instance.__dict__.pop('_stats_cleared_pks', set()), UserStats.OWNED_GAME_SECTIONS)
+    else:
+        UserStats.objects.mark_stale(pk_set, UserStats.OWNED_GAME_SECTIONS)
+
+
+@receiver(pre_delete, sender=Game)
+def game_deleted(sender, instance, **kwargs):
+    # the through rows go with the game without any m2m_changed signal
+    UserStats.objects.mark_stale(game_owner_ids([instance.pk]), UserStats.OWNED_GAME_SECTIONS)
+    UserStats.objects.mark_stale(gamenight_user_ids(instance.gamenights.values_list('pk', flat=True)), GAMENIGHT_SECTIONS)
+
+
+@receiver(post_save, sender=GameFeedback)
+@receiver(post_delete, sender=GameFeedback)
+def game_feedback_changed(sender, instance, **kwargs):
+    if instance.gamenight_id is not None:
+        UserStats.objects.mark_stale(gamenight_user_ids([instance.gamenight_id]), UserStats.RATING_SECTIONS)
+
+
+@receiver(post_save, sender=GeneralFeedback)
+@receiver(post_delete, sender=GeneralFeedback)
+def general_feedback_changed(sender, instance, **kwargs):
+    if instance.gamenight_id is not None:
+        UserStats.objects.mark_stale(gamenight_user_ids([instance.gamenight_id]), UserStats.WEEKDAY_SECTIONS)
+
+
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def contact_changed(sender, instance, **kwargs):
+    UserStats.objects.mark_stale([instance.user_id], CONTACT_SECTIONS)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    Category.objects.invalidate()
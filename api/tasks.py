@@ -1,9 +1,31 @@
+import logging
 from datetime import datetime, date
 from celery import Celery
 from django.core.mail import send_mail
+from django.db import transaction
 from games import settings
 from games.celery import app
 
+logger = logging.getLogger(__name__)
+
+
+def apply_on_commit(task, args=(), **options):
+    '''
+    Sends the task to the broker once the current transaction commits. The
+    data is committed by then, so a broker failure is logged instead of
+    raised. Only use it for tasks whose work a periodic task in
+    CELERYBEAT_SCHEDULE also picks up, or the work is lost with the message.
+    '''
+
+    def send():
+        try:
+            task.apply_async(args, **options)
+        except Exception:
+            logger.exception('Could not queue %s%r', task.name, tuple(args))
+
+    transaction.on_commit(send)
+
+
 @app.task
 def test_email(dt):
     message = f"The datetime is {dt}."
@@ -16,10 +38,104 @@ def test_email(dt):
     )
 
 @app.task
-def feedback_email(subject, message, email_list):
-    send_mail(
-        subject=subject,
-        message=message,
-        from_email=settings.EMAIL_HOST_USER,
-        recipient_list=email_list
-    )
\ No newline at end of file
+def send_due_reminders():
+    from .models import GameNight
+
+    return GameNight.objects.send_due_reminders()
+
+@app.task
+def send_due_feedback():
+    from .models import GameNight
+
+    return GameNight.objects.send_due_feedback()
+
+@app.task
+def refresh_user_stats(user_id):
+    from .models import CustomUser, UserStats
+
+    user = CustomUser.objects.filter(pk=user_id).first()
+    if user is None:
+        return
+    stats = UserStats.objects.filter(user=user).first()
+    if stats is not None and not stats.is_stale():
+        return
+    UserStats.objects.refresh(user)
+
+@app.task
+def refresh_stale_user_stats():
+    from .models import UserStats
+
+    return UserStats.objects.refresh_stale()
+
+@app.task
+def import_game(bgg):
+    from .importers import new_game, finish_game_import
+
+    try:
+        game = new_game(bgg)
+    except Exception:
+        finish_game_import(bgg, failed=True)
+        raise
+    finish_game_import(bgg)
+    return game.pk
+
+@app.task
+def import_collection(job_pk):
+    from django.utils import timezone
+    from .models import CollectionImport
+    from .importers import import_collection as run_import
+
+    # Running jobs are resumed, see resume_collection_imports
+    job = CollectionImport.objects.filter(pk=job_pk, status__in=['Pending', 'Running']).first()
+    if job is None:
+        return
+    try:
+        run_import(job)
+    except Exception as error:
+        job.status = 'Failed'
+        job.error = str(error)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+        raise
+
+@app.task
+def resume_collection_imports():
+    from django.utils import timezone
+    from .models import CollectionImport
+
+    job_pks = list(CollectionImport.objects.stalled().values_list('pk', flat=True))
+    # restarts the timeout, so a resumed job isn't queued again next sweep
+    CollectionImport.objects.filter(pk__in=job_pks).update(updated_at=timezone.now())
+    for job_pk in job_pks:
+        import_collection.apply_async((job_pk,))
+    return len(job_pks)
+
+@app.task
+def refresh_stale_games():
+    from .importers import refresh_stale_games as run_refresh
+
+    return run_refresh()
+
+@app.task
+def drain_outbox():
+    from .mail import drain
+
+    return drain()
+
+@app.task
+def flush_invite_notifications(gamenight_pk):
+    from .models import InviteNotification
+
+    return InviteNotification.objects.flush(gamenight_pk)
+
+@app.task
+def flush_due_invite_notifications():
+    from .models import InviteNotification
+
+    return InviteNotification.objects.flush_due()
+
+@app.task
+def prune_outbox():
+    from .models import Outbox
+
+    return Outbox.objects.prune()
@@ -1,3 +1,1211 @@
-from django.test import TestCase
+import io
+import json
+import random
+import socketserver
+import threading
+import time as clock
+from calendar import day_name
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import date, time, timedelta
+from unittest import mock
+import fakeredis
+from django.core import mail
+from django.core.management import call_command
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from games import settings
+from rest_framework.test import APIClient
+from . import mail as outbox_mail
+from .bgg import BGGClient, BGGError, get_things, iter_things
+from .importers import import_collection, new_game, refresh_stale_games
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from .ratelimit import RateLimited, TokenBucket, bgg_limiter
+from .models import CustomUser, Contact, Category, Game, GameNight, GeneralFeedback, GameFeedback, Voting, RSVP, InviteNotification, Outbox, BGGThing, UserStats, CollectionImport
+from .serializers import GameNightSerializer, UserStatsSerializer
+from .tasks import drain_outbox, flush_invite_notifications, refresh_user_stats, resume_collection_imports, import_collection as import_collection_task
 
-# Create your tests here.
+
+def legacy_weekday_stats(user):
+    '''
+    Copy of the per-gamenight weekday_stats implementation that the SQL
+    aggregation replaced, kept as the reference for its output. The only
+    difference is that nights without invitees are left out of the
+    attendance ratio, where the original raised ZeroDivisionError.
+    '''
+
+    def build_week_dict(user):
+        gamenights = user.gamenights.filter(status="Finalized").order_by('pk')
+        game_days = {}
+        days = list(day_name)
+        for day in days:
+            game_days[day] = []
+        for night in gamenights:
+            day = night.date.weekday()
+            game_days[days[day]].append(night)
+        return game_days
+
+    def days_avg_overall(gamenights):
+        gamenight_num = len(gamenights)
+        total = 0
+        for gamenight in gamenights:
+            overall = gamenight.calc_avg_overall()
+            if overall == None:
+                gamenight_num -= 1
+                continue
+            total += overall
+        if gamenight_num == 0:
+            average = None
+        else:
+            average = round(total/gamenight_num, 2)
+        return average
+
+    def days_avg_attend(gamenights):
+        gamenight_num = len(gamenights)
+        total = 0
+        for gamenight in gamenights:
+            attendees_num = len(gamenight.attendees.all())
+            invitees_num = len(gamenight.invitees.all())
+            if invitees_num == 0:
+                gamenight_num -= 1
+                continue
+            attendance = round(attendees_num/invitees_num, 2)
+            total += attendance
+        if gamenight_num == 0:
+            return None
+        else:
+            average = round((total/gamenight_num)*100, 2)
+        return average
+
+    def days_avg_session_len(gamenights):
+        gamenight_num = len(gamenights)
+        total = 0
+        for gamenight in gamenights:
+            session_len = gamenight.calc_session_len()
+            if session_len == None:
+                gamenight_num -= 1
+                continue
+            total += session_len
+        if gamenight_num == 0:
+            average = None
+        else:
+            average = round(total/gamenight_num, 2)
+        return average
+
+    def days_avg_game_num(gamenights):
+        gamenight_num = len(gamenights)
+        total = 0
+        for gamenight in gamenights:
+            game_num = len(gamenight.games.all())
+            if game_num == 0:
+                gamenight_num -=1
+                continue
+            total += game_num
+        if gamenight_num == 0:
+            average = None
+        else:
+            average = round(total/gamenight_num, 2)
+        return average
+
+    def days_avg_player_num(gamenights):
+        gamenight_num = len(gamenights)
+        total = 0
+        for gamenight in gamenights:
+            player_num = len(gamenight.attendees.all())
+            if player_num ==0:
+                gamenight_num -=1
+                continue
+            total += player_num
+        if gamenight_num == 0:
+            average = None
+        else:
+            average = round(total/gamenight_num, 2)
+        return average
+
+    gamenight_dict = build_week_dict(user)
+    days = gamenight_dict.keys()
+    stats_dict = {
+        'avg_overall_feedback': {},
+        'avg_attend_ratio': {},
+        'avg_session_len': {},
+        'avg_game_num': {},
+        'avg_player_num': {},
+        'sessions_num': {},
+    }
+    for day in days:
+        gamenights = gamenight_dict[day]
+        stats_dict['avg_overall_feedback'][day] = days_avg_overall(gamenights)
+        stats_dict['avg_attend_ratio'][day] = days_avg_attend(gamenights)
+        stats_dict['avg_session_len'][day] = days_avg_session_len(gamenights)
+        stats_dict['avg_game_num'][day] = days_avg_game_num(gamenights)
+        stats_dict['avg_player_num'][day] = days_avg_player_num(gamenights)
+        stats_dict['sessions_num'][day] = len(gamenights)
+    return stats_dict
+
+
+class WeekdayStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='host', email='host@example.com')
+        self.contacts = [
+            Contact.objects.create(user=self.user, first_name=f'Player{i}', last_name='Test', email=f'player{i}@example.com')
+            for i in range(8)
+        ]
+        self.games = [Game.objects.create(title=f'Game {i}', bgg=1000 + i, pub_year=2000) for i in range(5)]
+
+    def add_gamenight(self, day, start_time, end_time=None, status='Finalized', invitees=(), attendees=(), games=(), ratings=()):
+        gamenight = GameNight.objects.create(
+            user=self.user,
+            date=day,
+            rid=f'rid{GameNight.objects.count()}',
+            status=status,
+            start_time=start_time,
+            end_time=end_time,
+            location='Home',
+        )
+        gamenight.invitees.set(invitees)
+        gamenight.attendees.set(attendees)
+        gamenight.games.set(games)
+        for attendee, rating in zip(attendees, ratings):
+            GeneralFeedback.objects.create(gamenight=gamenight, attendee=attendee, overall_rating=rating)
+        return gamenight
+
+    def generate_gamenights(self, seed, count):
+        rng = random.Random(seed)
+        first_day = date(2022, 1, 3)
+        for i in range(count):
+            invitees = rng.sample(self.contacts, rng.randint(0, len(self.contacts)))
+            attendees = rng.sample(invitees, rng.randint(0, len(invitees)))
+            start_time = time(rng.randint(12, 22), rng.choice([0, 15, 30, 45]))
+            end_time = rng.choice([None, time(rng.randint(0, 23), rng.choice([0, 20, 40]))])
+            self.add_gamenight(
+                first_day + timedelta(days=rng.randint(0, 120)),
+                start_time,
+                end_time,
+                status=rng.choice(['Finalized', 'Finalized', 'Finalized', 'Voting', 'Cancelled']),
+                invitees=invitees,
+                attendees=attendees,
+                games=rng.sample(self.games, rng.randint(0, len(self.games))),
+                ratings=[rng.randint(1, 5) for attendee in attendees if rng.random() < 0.7],
+            )
+
+    def assert_matches_legacy(self):
+        expected = legacy_weekday_stats(self.user)
+        actual = UserStatsSerializer(self.user).get_weekday_stats(self.user)
+        self.assertEqual(actual, expected)
+        self.assertEqual(json.dumps(actual), json.dumps(expected))
+
+    def test_no_gamenights(self):
+        self.assert_matches_legacy()
+
+    def test_edge_cases(self):
+        monday = date(2022, 1, 3)
+        # no invitees, no feedback and no end_time
+        self.add_gamenight(monday, time(18))
+        # past-midnight end
+        self.add_gamenight(monday + timedelta(days=1), time(21, 30), time(1, 15), invitees=self.contacts[:3], attendees=self.contacts[:2], games=self.games[:2], ratings=[4, 5])
+        # invitees but nobody came
+        self.add_gamenight(monday + timedelta(days=1), time(19), time(22), invitees=self.contacts[:4])
+        # not finalized, left out
+        self.add_gamenight(monday + timedelta(days=2), time(19), time(23), status='Voting', invitees=self.contacts[:2], attendees=self.contacts[:1], ratings=[3])
+        self.assert_matches_legacy()
+
+    def test_generated_gamenights(self):
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                GameNight.objects.all().delete()
+                self.generate_gamenights(seed, 40)
+                self.assert_matches_legacy()
+
+
+class PlayIndexTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='host', email='host@example.com')
+        strategy = Category.objects.create(name='Strategy')
+        self.games = [Game.objects.create(title=title, bgg=bgg, pub_year=2000) for bgg, title in enumerate(['Catan', 'Azul', 'Go'])]
+        for game in self.games:
+            game.owners.add(self.user)
+            game.categories.add(strategy)
+        for day in (1, 2):
+            gamenight = GameNight.objects.create(
+                user=self.user, date=date(2022, 2, day), rid=f'night{day}', start_time=time(19), location='Home'
+            )
+            gamenight.games.set(self.games[:day])
+
+    def test_fields_share_one_index(self):
+        serializer = UserStatsSerializer(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            most_played = serializer.get_most_played_games(self.user)
+        self.assertEqual(len(queries), 2)
+        with self.assertNumQueries(0):
+            least_played = serializer.get_least_played_games(self.user)
+            not_played = serializer.get_games_not_played(self.user)
+        # only the category list itself is loaded
+        with self.assertNumQueries(1):
+            categories = serializer.get_most_played_categories(self.user)
+        self.assertEqual([(game['title'], game['played']) for game in most_played], [('Catan', 2), ('Azul', 1)])
+        self.assertEqual(least_played[0]['last_played'], '2022-02-02')
+        self.assertEqual([game['name'] for game in not_played], ['Go'])
+        self.assertEqual(categories[0]['games_played'], 3)
+
+
+class GameNightDetailQueryTests(TestCase):
+
+    def build_gamenight(self, rid, size):
+        user = CustomUser.objects.create(username=f'host-{rid}', email=f'{rid}@example.com')
+        category = Category.objects.create(name=f'Category {rid}')
+        games = [Game.objects.create(title=f'Game {rid} {i}', bgg=size * 1000 + i, pub_year=2000) for i in range(size)]
+        for game in games:
+            game.categories.add(category)
+        contacts = [
+            Contact.objects.create(user=user, first_name=f'Player{i}', last_name=rid, email=f'player{i}@{rid}.com')
+            for i in range(size)
+        ]
+        gamenight = GameNight.objects.create(
+            user=user, date=date(2022, 2, 1), rid=rid, start_time=time(19), end_time=time(23), location='Home'
+        )
+        gamenight.invitees.set(contacts)
+        gamenight.attendees.set(contacts[:size // 2])
+        gamenight.games.set(games[:1])
+        gamenight.options.set(games)
+        for i, contact in enumerate(contacts):
+            if i % 2 == 0:
+                RSVP.objects.create(gamenight=gamenight, invitee=contact, attending=True)
+            Voting.objects.create(gamenight=gamenight, invitee=contact, game=games[i], vote=1)
+            GeneralFeedback.objects.create(gamenight=gamenight, attendee=contact, overall_rating=4, comments=f'Comment {i}')
+            GameFeedback.objects.create(gamenight=gamenight, attendee=contact, game=games[i], rating=5)
+        return gamenight
+
+    def count_queries(self, gamenight):
+        client = APIClient()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f'/gamenight/{gamenight.rid}/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_query_count_does_not_grow(self):
+        small = self.build_gamenight('small', 2)
+        large = self.build_gamenight('large', 30)
+        small_count, small_data = self.count_queries(small)
+        self.assertEqual(len(small_data['options']), 2)
+        self.assertEqual(len(small_data['comments']), 2)
+        with self.assertNumQueries(small_count):
+            response = APIClient().get(f'/gamenight/{large.rid}/')
+        data = response.json()
+        self.assertEqual(len(data['options']), 30)
+        self.assertEqual(len(data['comments']), 30)
+        self.assertEqual(len(data['invitees']) + len(data['rsvps']), 30)
+
+    def test_invitees_without_rsvp(self):
+        gamenight = self.build_gamenight('night', 6)
+        rsvped = set(gamenight.rsvps.values_list('invitee__first_name', flat=True))
+        self.assertEqual(rsvped, {'Player0', 'Player2', 'Player4'})
+        # the prefetched and the plain instance filter the same way
+        for instance in (GameNight.objects.with_related().get(pk=gamenight.pk), GameNight.objects.get(pk=gamenight.pk)):
+            invitees = GameNightSerializer(instance).data['invitees']
+            self.assertEqual(sorted(invitee['first_name'] for invitee in invitees), ['Player1', 'Player3', 'Player5'])
+
+
+class ContactListQueryTests(TestCase):
+
+    def build_contacts(self, name, size):
+        user = CustomUser.objects.create(username=name, email=f'{name}@example.com')
+        games = [Game.objects.create(title=f'Game {name} {i}', bgg=size * 1000 + i, pub_year=2000) for i in range(6)]
+        gamenights = [
+            GameNight.objects.create(user=user, date=date(2022, 2, day), rid=f'{name}{day}', start_time=time(19), location='Home')
+            for day in (1, 2)
+        ]
+        contacts = [
+            Contact.objects.create(user=user, first_name=f'Player{i}', last_name=name, email=f'player{i}@{name}.com')
+            for i in range(size)
+        ]
+        for gamenight in gamenights:
+            gamenight.invitees.set(contacts)
+        gamenights[0].attendees.set(contacts[::2])
+        Contact.objects.create(user=user, first_name='Stranger', last_name=name, email=f'stranger@{name}.com')
+        for i, contact in enumerate(contacts):
+            for j, game in enumerate(games):
+                GameFeedback.objects.create(gamenight=gamenights[0], attendee=contact, game=game, rating=j % 5 + 1)
+            Voting.objects.create(gamenight=gamenights[0], invitee=contact, game=games[4], vote=1)
+        return user
+
+    def get_contacts(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/contacts/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_favorite_games_query_count_does_not_grow(self):
+        small_count, small_data = self.get_contacts(self.build_contacts('small', 2))
+        large_count, large_data = self.get_contacts(self.build_contacts('large', 20))
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(len(large_data), 21)
+        for contact in large_data:
+            if contact['first_name'] == 'Stranger':
+                self.assertEqual(contact['favorite_games'], [])
+                continue
+            favorites = contact['favorite_games']
+            self.assertEqual(len(favorites), 5)
+            self.assertEqual(favorites[0]['title'], 'Game large 4')
+            self.assertEqual((favorites[0]['avg_feedback'], favorites[0]['accum_votes']), (5, 1))
+            self.assertEqual([game['avg_feedback'] for game in favorites], sorted((game['avg_feedback'] for game in favorites), reverse=True))
+
+    def test_attendance_rate_annotated(self):
+        small_count, small_data = self.get_contacts(self.build_contacts('small', 2))
+        large_count, large_data = self.get_contacts(self.build_contacts('large', 20))
+        self.assertEqual(small_count, large_count)
+        rates = {contact['first_name']: contact['attendance_rate'] for contact in large_data}
+        # attended one of two nights, none, or never invited
+        self.assertEqual(rates['Player0'], 50)
+        self.assertEqual(rates['Player1'], 0)
+        self.assertEqual(rates['Stranger'], 0)
+        contact = Contact.objects.get(first_name='Player2', last_name='large')
+        self.assertEqual(contact.attend_percent(), rates['Player2'])
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def open(self):
+        raise ConnectionRefusedError('SMTP server unavailable')
+
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('SMTP server unavailable')
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    '''
+    Speaks just enough SMTP for smtplib, recording every connection and the
+    recipients of every message on the server.
+    '''
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost SMTP stand-in')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply('250 localhost')
+            elif command == b'RCPT':
+                recipients.append(line.decode().split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 OK')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() != b'.\r\n':
+                    pass
+                self.server.messages.append(recipients)
+                recipients = []
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='host', email='host@example.com')
+        self.contacts = [
+            Contact.objects.create(user=self.user, first_name=f'Player{i}', last_name='Test', email=f'player{i}@example.com')
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # no broker in tests, the tasks are run directly where needed
+        self.drain_outbox_apply_async = self.patch(drain_outbox, 'apply_async')
+        self.flush_invite_notifications_apply_async = self.patch(flush_invite_notifications, 'apply_async')
+        self.patch(refresh_user_stats, 'apply_async')
+
+    def patch(self, target, attribute):
+        patcher = mock.patch.object(target, attribute)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def create_gamenight(self, invitees):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/gamenight/', {
+                'date': '2022-02-01',
+                'start_time': '19:00',
+                'location': 'Home',
+                'invitees': [contact.pk for contact in invitees],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return GameNight.objects.get(rid=response.data['rid'])
+
+    def test_create_gamenight_writes_outbox(self):
+        self.create_gamenight(self.contacts[:2])
+        emails = list(Outbox.objects.all())
+        self.assertEqual(len(emails), 1)
+        self.assertEqual(emails[0].status, 'Pending')
+        self.assertEqual(sorted(emails[0].recipient_list), ['player0@example.com', 'player1@example.com'])
+        self.drain_outbox_apply_async.assert_called_once_with(())
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_add_invitees_writes_outbox(self):
+        gamenight = self.create_gamenight(self.contacts[:1])
+        Outbox.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/gamenight/{gamenight.rid}/', {
+                'invitees': [{'pk': contact.pk} for contact in self.contacts[1:]],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.flush_invite_notifications_apply_async.call_count, 2)
+        self.assertFalse(Outbox.objects.exists())
+
+        # once the debounce window has passed the flush mails both in one email
+        InviteNotification.objects.filter(sent_at=None).update(queued_at=timezone.now() - timedelta(days=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush_invite_notifications(gamenight.pk), 2)
+        emails = list(Outbox.objects.all())
+        self.assertEqual(len(emails), 1)
+        self.assertEqual(sorted(emails[0].recipient_list), ['player1@example.com', 'player2@example.com'])
+        self.drain_outbox_apply_async.assert_called()
+
+    def test_drain_sends_one_batch(self):
+        for contact in self.contacts:
+            Outbox.objects.create(subject='Game night!', message='Be there', recipient_list=[contact.email])
+        with mock.patch.object(outbox_mail, 'get_connection', wraps=outbox_mail.get_connection) as get_connection:
+            metrics = outbox_mail.drain()
+        get_connection.assert_called_once()
+        self.assertEqual(metrics['sent'], 3)
+        self.assertEqual(metrics['retried'], 0)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [contact.email for contact in self.contacts])
+        self.assertFalse(Outbox.objects.exclude(status='Sent').exists())
+        self.assertEqual(outbox_mail.drain()['sent'], 0)
+
+    def test_broker_failure_does_not_fail_request(self):
+        self.drain_outbox_apply_async.side_effect = ConnectionRefusedError('broker unavailable')
+        with self.assertLogs('api.tasks', 'ERROR'):
+            self.create_gamenight(self.contacts[:2])
+        self.assertEqual(Outbox.objects.count(), 1)
+
+    def test_delivers_outside_transaction(self):
+        email = Outbox.objects.create(subject='Game night!', message='Be there', recipient_list=['player0@example.com'])
+        depth = len(connection.atomic_blocks)
+
+        def deliver(emails):
+            # the claim has been committed before any email goes out
+            self.assertEqual(len(connection.atomic_blocks), depth)
+            self.assertGreater(Outbox.objects.get(pk=email.pk).next_attempt_at, timezone.now())
+            self.assertEqual(outbox_mail.claim(10), [])
+            return real_deliver(emails)
+
+        real_deliver = outbox_mail.deliver
+        with mock.patch.object(outbox_mail, 'deliver', side_effect=deliver) as patched:
+            self.assertEqual(outbox_mail.drain()['sent'], 1)
+        patched.assert_called_once()
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'Sent')
+
+    def test_expired_lease_is_reclaimed(self):
+        email = Outbox.objects.create(subject='Game night!', message='Be there', recipient_list=['player0@example.com'])
+        self.assertEqual(outbox_mail.claim(10), [email])
+        self.assertEqual(outbox_mail.claim(10), [])
+        # the worker holding the lease died without writing a result
+        Outbox.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox_mail.drain()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_lost_invite_flush_is_swept(self):
+        gamenight = self.create_gamenight(self.contacts[:1])
+        gamenight.update_invitees(self.contacts[1].pk)
+        Outbox.objects.all().delete()
+        # the flush task was never delivered
+        self.assertEqual(InviteNotification.objects.flush_due(), 0)
+        InviteNotification.objects.filter(sent_at=None).update(queued_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(InviteNotification.objects.flush_due(), 1)
+        self.assertEqual([email.recipient_list for email in Outbox.objects.all()], [['player1@example.com']])
+        self.assertEqual(InviteNotification.objects.flush_due(), 0)
+
+    def test_toggled_invitee_mailed_once(self):
+        gamenight = self.create_gamenight(self.contacts[:1])
+        Outbox.objects.all().delete()
+        contact = self.contacts[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                gamenight.update_invitees(contact.pk)
+        # still inside the debounce window
+        self.assertEqual(flush_invite_notifications(gamenight.pk), 0)
+        InviteNotification.objects.filter(sent_at=None).update(queued_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(flush_invite_notifications(gamenight.pk), 1)
+        # toggling a contact who was mailed already queues nothing
+        gamenight.update_invitees(contact.pk)
+        gamenight.update_invitees(contact.pk)
+        InviteNotification.objects.update(queued_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(InviteNotification.objects.flush_due(), 0)
+        self.assertEqual([email.recipient_list for email in Outbox.objects.all()], [[contact.email]])
+
+    def test_prune(self):
+        old = timezone.now() - timedelta(days=60)
+        kept = [
+            Outbox.objects.create(subject='Recent', message='', recipient_list=['a@example.com'], status='Sent', sent_at=timezone.now()),
+            Outbox.objects.create(subject='Failed', message='', recipient_list=['a@example.com'], status='Failed'),
+            Outbox.objects.create(subject='Pending', message='', recipient_list=['a@example.com']),
+        ]
+        Outbox.objects.create(subject='Old', message='', recipient_list=['a@example.com'], status='Sent', sent_at=old)
+        Outbox.objects.update(created_at=old)
+        self.assertEqual(Outbox.objects.prune(), 1)
+        self.assertEqual(list(Outbox.objects.order_by('pk')), kept)
+
+    def rsvp(self, gamenight, contact):
+        return self.client.post(f'/gamenight/{gamenight.rid}/RSVP/', {
+            'invitee': {'first_name': contact.first_name, 'last_name': contact.last_name, 'email': contact.email},
+            'attending': 'True',
+        }, format='json')
+
+    def test_rsvp_is_one_transaction(self):
+        gamenight = self.create_gamenight(self.contacts[:2])
+        GameNight.objects.filter(pk=gamenight.pk).update(status='Finalized')
+        Outbox.objects.all().delete()
+        with mock.patch.object(GameNight, 'mail_finalized', side_effect=RuntimeError('mail failed')):
+            with self.assertRaises(RuntimeError):
+                self.rsvp(gamenight, self.contacts[0])
+        gamenight.refresh_from_db()
+        self.assertFalse(gamenight.rsvps.exists())
+        self.assertFalse(gamenight.attendees.exists())
+        self.assertIsNone(gamenight.feedback_due_at)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.rsvp(gamenight, self.contacts[0]).status_code, 201)
+        gamenight.refresh_from_db()
+        self.assertEqual(list(gamenight.attendees.all()), [self.contacts[0]])
+        self.assertIsNotNone(gamenight.feedback_due_at)
+        self.assertEqual([email.recipient_list for email in Outbox.objects.all()], [['player0@example.com']])
+
+    def test_drain_over_smtp(self):
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPStandInHandler)
+        server.daemon_threads = True
+        server.connections = 0
+        server.messages = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        for i in range(5):
+            Outbox.objects.create(subject='Game night!', message='Be there', recipient_list=[f'player{i}@example.com'])
+        host, port = server.server_address
+        with override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST=host,
+            EMAIL_PORT=port,
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+        ):
+            metrics = outbox_mail.drain()
+        self.assertEqual(metrics['sent'], 5)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(sorted(server.messages), [[f'player{i}@example.com'] for i in range(5)])
+        self.assertFalse(Outbox.objects.exclude(status='Sent').exists())
+
+    @override_settings(EMAIL_BACKEND='api.tests.FailingEmailBackend')
+    def test_failed_connection_reschedules(self):
+        email = Outbox.objects.create(subject='Game night!', message='Be there', recipient_list=['player0@example.com'])
+        before = timezone.now()
+        metrics = outbox_mail.drain()
+        after = timezone.now()
+        self.assertEqual(metrics['sent'], 0)
+        self.assertEqual(metrics['retried'], 1)
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'Pending')
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('SMTP server unavailable', email.last_error)
+        delay = timedelta(seconds=outbox_mail.retry_delay(1))
+        self.assertTrue(before + delay <= email.next_attempt_at <= after + delay)
+        # not due again until the retry delay has passed
+        self.assertEqual(outbox_mail.drain()['retried'], 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class GameNightSweepTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='host', email='host@example.com')
+        self.contact = Contact.objects.create(user=self.user, first_name='Player', last_name='Test', email='player@example.com')
+        patcher = mock.patch.object(drain_outbox, 'apply_async')
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def create_gamenight(self, rid, starts_at, status='Finalized'):
+        starts_at = timezone.localtime(starts_at)
+        gamenight = GameNight.objects.create(
+            user=self.user, date=starts_at.date(), rid=rid, status=status, start_time=starts_at.time(), location='Home'
+        )
+        gamenight.attendees.add(self.contact)
+        return gamenight
+
+    def test_feedback_sent_once_when_due(self):
+        now = timezone.now()
+        due = self.create_gamenight('due', now - timedelta(days=2))
+        later = self.create_gamenight('later', now)
+        voting = self.create_gamenight('voting', now - timedelta(days=2), status='Voting')
+        for gamenight in (due, later, voting):
+            gamenight.schedule_feedback()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(GameNight.objects.send_due_feedback(), 1)
+        self.assertEqual(Outbox.objects.count(), 1)
+        self.assertEqual(Outbox.objects.get().recipient_list, ['player@example.com'])
+        due.refresh_from_db()
+        self.assertIsNone(due.feedback_due_at)
+        self.assertEqual(GameNight.objects.send_due_feedback(), 0)
+        # cancelling a finalized GameNight drops its pending request
+        later.status = 'Cancelled'
+        later.update_feedback()
+        self.assertIsNone(GameNight.objects.get(pk=later.pk).feedback_due_at)
+
+    def test_reminder_sent_once_within_window(self):
+        now = timezone.now()
+        soon = self.create_gamenight('soon', now + timedelta(hours=settings.REMINDER_HOURS - 1))
+        self.create_gamenight('far', now + timedelta(hours=settings.REMINDER_HOURS + 1))
+        self.create_gamenight('past', now - timedelta(hours=1))
+        self.create_gamenight('voting', now + timedelta(hours=1), status='Voting')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(GameNight.objects.send_due_reminders(), 1)
+        self.assertEqual(Outbox.objects.count(), 1)
+        self.assertTrue(Outbox.objects.get().subject.startswith('Reminder'))
+        self.assertEqual(GameNight.objects.send_due_reminders(), 0)
+
+        # moving the GameNight gets it a reminder for the new time
+        soon.refresh_from_db()
+        self.assertIsNotNone(soon.reminder_sent_at)
+        moved = timezone.localtime(soon.starts_at) - timedelta(minutes=30)
+        soon.date, soon.start_time = moved.date(), moved.time()
+        soon.save(update_fields=['date', 'start_time'])
+        soon.refresh_from_db()
+        self.assertIsNone(soon.reminder_sent_at)
+        self.assertEqual(GameNight.objects.send_due_reminders(), 1)
+
+
+class StubBGGHandler(BaseHTTPRequestHandler):
+    '''
+    Answers each GET with the next (status, headers, delay) of the server's
+    responses list, repeating the last one.
+    '''
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        responses = self.server.responses
+        status, headers, delay = responses.pop(0) if len(responses) > 1 else responses[0]
+        if delay:
+            clock.sleep(delay)
+        body = b'<items></items>'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BGGClientTests(SimpleTestCase):
+
+    def serve(self, responses):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubBGGHandler)
+        server.daemon_threads = True
+        server.responses = list(responses)
+        server.paths = []
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def client_for(self, server, **kwargs):
+        host, port = server.server_address
+        return BGGClient(base_url=f'http://{host}:{port}', backoff=0, **kwargs)
+
+    def test_retries_queued_and_throttled_requests(self):
+        server = self.serve([
+            (202, {}, 0),
+            (429, {'Retry-After': '0'}, 0),
+            (200, {}, 0),
+        ])
+        client = self.client_for(server, max_retries=3)
+        self.assertEqual(client.thing(13), b'<items></items>')
+        self.assertEqual(len(server.paths), 3)
+        self.assertTrue(all(path.startswith('/xmlapi2/thing?id=13') for path in server.paths))
+        self.assertEqual(client.metrics['calls'], 3)
+        self.assertEqual(client.metrics['retries'], 2)
+        self.assertEqual(client.metrics['failures'], 0)
+        self.assertGreaterEqual(client.metrics['total_latency'], client.metrics['max_latency'])
+
+    def test_retry_after_is_capped(self):
+        server = self.serve([(429, {'Retry-After': '3600'}, 0), (200, {}, 0)])
+        client = self.client_for(server, max_retries=1, max_delay=0.01)
+        self.assertEqual(client.retry_delay(0, mock.Mock(headers={'Retry-After': '3600'})), 0.01)
+        start = clock.monotonic()
+        self.assertEqual(client.thing(13), b'<items></items>')
+        self.assertLess(clock.monotonic() - start, 5)
+        # the exponential backoff is capped too
+        self.assertEqual(BGGClient(backoff=1, max_delay=60).retry_delay(10), 60)
+
+    @override_settings(BGG_COLLECTION_MAX_RETRIES=5)
+    def test_collection_waits_longer_while_queued(self):
+        server = self.serve([(202, {}, 0)] * 5 + [(200, {}, 0)])
+        client = self.client_for(server, max_retries=2)
+        self.assertEqual(client.collection('player'), b'<items></items>')
+        self.assertEqual(client.metrics['retries'], 5)
+        self.assertIn('excludesubtype=boardgameexpansion', server.paths[0])
+        # other requests keep the client's budget
+        client = self.client_for(self.serve([(202, {}, 0)] * 5 + [(200, {}, 0)]), max_retries=2)
+        with self.assertRaises(BGGError):
+            client.thing(13)
+        self.assertEqual(client.metrics['retries'], 2)
+
+    def test_gives_up_after_max_retries(self):
+        server = self.serve([(503, {}, 0)])
+        client = self.client_for(server, max_retries=2)
+        with self.assertRaises(BGGError):
+            client.thing(13)
+        self.assertEqual(len(server.paths), 3)
+        self.assertEqual(client.metrics['retries'], 2)
+        self.assertEqual(client.metrics['failures'], 1)
+
+    def test_timeout_raises(self):
+        server = self.serve([(200, {}, 1)])
+        client = self.client_for(server, max_retries=0, timeout=(1, 0.1))
+        with self.assertRaises(BGGError):
+            client.thing(13)
+        self.assertEqual(client.metrics['calls'], 1)
+        self.assertEqual(client.metrics['retries'], 0)
+        self.assertEqual(client.metrics['failures'], 1)
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeStrictRedis(server=self.server)
+
+    def bucket(self, rate=20, burst=3, max_wait=1):
+        return TokenBucket(self.redis, 'test-bucket', rate=rate, burst=burst, max_wait=max_wait)
+
+    def test_burst(self):
+        bucket = self.bucket()
+        self.assertEqual([bucket.take() for i in range(3)], [0, 0, 0])
+        wait = bucket.take()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1 / 20)
+
+    def test_refill(self):
+        bucket = self.bucket()
+        for i in range(3):
+            bucket.acquire()
+        self.assertEqual(bucket.metrics['waits'], 0)
+        bucket.acquire()
+        self.assertEqual(bucket.metrics['acquired'], 4)
+        self.assertEqual(bucket.metrics['waits'], 1)
+        self.assertGreater(bucket.metrics['max_wait'], 0)
+        clock.sleep(3 / 20)
+        # the bucket never holds more than burst tokens
+        self.assertEqual([bucket.take() for i in range(3)], [0, 0, 0])
+        self.assertGreater(bucket.take(), 0)
+
+    def test_shared_between_buckets(self):
+        self.bucket().take()
+        self.bucket().take()
+        self.bucket().take()
+        self.assertGreater(self.bucket().take(), 0)
+
+    def test_rejects_after_max_wait(self):
+        bucket = self.bucket(rate=1, burst=1, max_wait=0.1)
+        bucket.acquire()
+        with self.assertRaises(RateLimited), self.assertLogs('api.ratelimit', 'WARNING'):
+            bucket.acquire()
+        self.assertEqual(bucket.metrics['acquired'], 1)
+        self.assertEqual(bucket.metrics['rejections'], 1)
+
+    def test_metrics_shared_between_buckets(self):
+        bucket = self.bucket(burst=1)
+        bucket.acquire()
+        bucket.acquire()
+        other = self.bucket(burst=1, max_wait=0)
+        with self.assertRaises(RateLimited), self.assertLogs('api.ratelimit', 'WARNING'):
+            other.acquire()
+        metrics = other.shared_metrics()
+        self.assertEqual((metrics['acquired'], metrics['waits'], metrics['rejections']), (2, 1, 1))
+        self.assertGreater(metrics['total_wait'], 0)
+
+    def test_stats_command(self):
+        out = io.StringIO()
+        with mock.patch('api.ratelimit.get_redis', return_value=self.redis), \
+                override_settings(BGG_RATE_LIMIT=20, BGG_RATE_BURST=1, BGG_RATE_MAX_WAIT=0):
+            bgg_limiter().acquire()
+            with self.assertRaises(RateLimited), self.assertLogs('api.ratelimit', 'WARNING'):
+                bgg_limiter().acquire()
+            call_command('ratelimit_stats', stdout=out)
+        self.assertIn('Acquired: 1', out.getvalue())
+        self.assertIn('Rejected: 1', out.getvalue())
+
+    def test_fails_open_without_redis(self):
+        bucket = self.bucket(rate=1, burst=1, max_wait=0)
+        self.server.connected = False
+        with self.assertLogs('api.ratelimit', 'WARNING'):
+            for i in range(3):
+                bucket.acquire()
+        self.assertEqual(bucket.metrics['errors'], 3)
+        self.assertEqual(bucket.metrics['acquired'], 0)
+        self.assertEqual(bucket.metrics['rejections'], 0)
+
+
+def thing_xml(bgg, title):
+    return (
+        f'<item type="boardgame" id="{bgg}"><name type="primary" value="{title}"/>'
+        '<yearpublished value="1995"/><minplayers value="3"/><maxplayers value="4"/>'
+        '<playingtime value="120"/><minage value="10"/>'
+        '<link type="boardgamecategory" id="1" value="Negotiation"/></item>'
+    ).encode()
+
+
+class GameCreationTests(TransactionTestCase):
+
+    def setUp(self):
+        patcher = mock.patch('api.importers.get_redis', return_value=fakeredis.FakeStrictRedis(server=fakeredis.FakeServer()))
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def create_concurrently(self, get_thing, threads=4):
+        def create():
+            try:
+                new_game(13)
+            finally:
+                connection.close()
+
+        with mock.patch('api.importers.get_thing', side_effect=get_thing) as get_thing:
+            workers = [threading.Thread(target=create) for i in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        return get_thing
+
+    def test_concurrent_creation_fetches_once(self):
+        def get_thing(bgg):
+            clock.sleep(0.2)
+            return next(iter_things(b'<items>' + thing_xml(bgg, 'Catan') + b'</items>'))
+
+        get_thing = self.create_concurrently(get_thing)
+        self.assertEqual(get_thing.call_count, 1)
+        self.assertEqual(Game.objects.filter(bgg=13).count(), 1)
+
+    def test_unique_bgg_without_lock(self):
+        # every process gets past the lock and fetches the game
+        barrier = threading.Barrier(2, timeout=5)
+
+        def get_thing(bgg):
+            barrier.wait()
+            return next(iter_things(b'<items>' + thing_xml(bgg, 'Catan') + b'</items>'))
+
+        with mock.patch('redis.lock.Lock.acquire', return_value=False), self.assertLogs('api.importers', 'WARNING'):
+            get_thing = self.create_concurrently(get_thing, threads=2)
+        self.assertEqual(get_thing.call_count, 2)
+        self.assertEqual(Game.objects.filter(bgg=13).count(), 1)
+        self.assertEqual(list(Game.objects.get(bgg=13).categories.values_list('name', flat=True)), ['Negotiation'])
+
+
+class GameRefreshTests(TestCase):
+
+    def setUp(self):
+        self.games = [Game.objects.create(title=f'Game {bgg}', bgg=bgg, pub_year=1990) for bgg in (13, 14)]
+        BGGThing.objects.store({game.bgg: thing_xml(game.bgg, f'Cached {game.bgg}') for game in self.games})
+        BGGThing.objects.update(fetched_at=timezone.now() - timedelta(days=30))
+        patcher = mock.patch('api.bgg.get_client')
+        self.addCleanup(patcher.stop)
+        self.client = patcher.start().return_value
+
+    def test_bgg_down_serves_expired_cache(self):
+        self.client.things.side_effect = BGGError('BGG unavailable')
+        with self.assertLogs('api.bgg', 'WARNING'):
+            things = get_things([13, 14])
+        self.assertEqual([thing['title'] for thing in things], ['Cached 13', 'Cached 14'])
+        with self.assertRaises(BGGError):
+            get_things([13, 14], refresh=True)
+
+    def test_bgg_down_leaves_games_unrefreshed(self):
+        self.client.things.side_effect = BGGError('BGG unavailable')
+        with self.assertLogs('api.importers', 'WARNING'):
+            self.assertEqual(refresh_stale_games(), (0, 0))
+        self.assertFalse(Game.objects.filter(refreshed_at__isnull=False).exists())
+        self.assertFalse(Game.objects.filter(title__startswith='Cached').exists())
+
+    def test_refresh(self):
+        self.client.things.return_value = b'<items>' + b''.join(thing_xml(game.bgg, f'Fresh {game.bgg}') for game in self.games) + b'</items>'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(refresh_stale_games(), (2, 2))
+        self.assertEqual(sorted(Game.objects.values_list('title', flat=True)), ['Fresh 13', 'Fresh 14'])
+        self.assertFalse(Game.objects.filter(refreshed_at__isnull=True).exists())
+
+
+class UserStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='host', email='host@example.com')
+
+    def test_built_inline_when_missing(self):
+        with mock.patch.object(UserStats.objects, 'refresh', wraps=UserStats.objects.refresh) as refresh:
+            data = UserStats.objects.for_user(self.user)
+        refresh.assert_called_once_with(self.user)
+        self.assertIn('weekday_stats', data)
+        stats = UserStats.objects.get(user=self.user)
+        self.assertFalse(stats.is_stale())
+        self.assertEqual(stats.get_data(), data)
+
+    def test_stale_row_served_while_refresh_queued(self):
+        UserStats.objects.for_user(self.user)
+        UserStats.objects.filter(user=self.user).update(payload='{"built": "before"}')
+        with mock.patch.object(refresh_user_stats, 'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                UserStats.objects.mark_stale([self.user.pk])
+        apply_async.assert_called_once_with((self.user.pk,))
+        self.assertTrue(UserStats.objects.get(user=self.user).is_stale())
+        with mock.patch.object(UserStats.objects, 'refresh') as refresh:
+            self.assertEqual(UserStats.objects.for_user(self.user), {'built': 'before'})
+        refresh.assert_not_called()
+
+    def test_stale_row_rebuilt_past_max_staleness(self):
+        UserStats.objects.for_user(self.user)
+        UserStats.objects.mark_stale([self.user.pk])
+        UserStats.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        UserStats.objects.for_user(self.user)
+        self.assertFalse(UserStats.objects.get(user=self.user).is_stale())
+
+    def test_refreshes_stale_sections_only(self):
+        game = Game.objects.create(title='Catan', bgg=13, pub_year=1995)
+        UserStats.objects.for_user(self.user)
+        with mock.patch('api.serializers.UserStatsSerializer.get_weekday_stats') as get_weekday_stats:
+            game.owners.add(self.user)
+            stats = UserStats.objects.get(user=self.user)
+            self.assertEqual(set(stats.get_stale_sections()), set(UserStats.OWNED_GAME_SECTIONS))
+            UserStats.objects.refresh(self.user)
+        get_weekday_stats.assert_not_called()
+        stats = UserStats.objects.get(user=self.user)
+        self.assertFalse(stats.is_stale())
+        self.assertEqual(stats.stale_sections, 0)
+        self.assertEqual(list(stats.get_data()), list(UserStats.SECTIONS))
+        self.assertEqual([game['name'] for game in stats.get_data()['games_not_played']], ['Catan'])
+        self.assertEqual(stats.payload, json.dumps(UserStatsSerializer(self.user).data))
+
+    def test_change_during_refresh_is_kept(self):
+        UserStats.objects.for_user(self.user)
+        UserStats.objects.mark_stale([self.user.pk], UserStats.PLAYER_SECTIONS)
+        real_get_most_common_players = UserStatsSerializer.get_most_common_players
+
+        def get_most_common_players(serializer, obj):
+            # a change comes in while the refresh is running
+            UserStats.objects.mark_stale([self.user.pk], UserStats.RATING_SECTIONS)
+            return real_get_most_common_players(serializer, obj)
+
+        with mock.patch.object(UserStatsSerializer, 'get_most_common_players', get_most_common_players):
+            UserStats.objects.refresh(self.user)
+        stats = UserStats.objects.get(user=self.user)
+        self.assertTrue(stats.is_stale())
+        self.assertEqual(stats.get_stale_sections(), ['most_common_players', 'highest_rated_games'])
+
+    def test_sweep_rebuilds_stale_rows(self):
+        other = CustomUser.objects.create(username='other', email='other@example.com')
+        for user in (self.user, other):
+            UserStats.objects.for_user(user)
+        UserStats.objects.mark_stale([self.user.pk])
+        self.assertEqual(UserStats.objects.refresh_stale(), 1)
+        self.assertFalse(UserStats.objects.filter(built_version__lt=F('version')).exists())
+        self.assertEqual(UserStats.objects.refresh_stale(), 0)
+
+
+class UserStatsSignalTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='host', email='host@example.com')
+        self.owner = CustomUser.objects.create(username='owner', email='owner@example.com')
+        self.contact = Contact.objects.create(user=self.user, first_name='Player', last_name='Test', email='player@example.com')
+        self.game = Game.objects.create(title='Catan', bgg=13, pub_year=1995)
+        self.game.owners.add(self.owner)
+        self.gamenight = GameNight.objects.create(user=self.user, date=date(2022, 2, 1), rid='rid', status='Finalized', start_time=time(19), location='Home')
+        self.gamenight.invitees.add(self.contact)
+        self.gamenight.attendees.add(self.contact)
+        self.gamenight.games.add(self.game)
+        for user in (self.user, self.owner):
+            UserStats.objects.refresh(user, full=True)
+
+    def assert_marked(self, user, sections):
+        stats = UserStats.objects.get(user=user)
+        self.assertTrue(stats.is_stale())
+        self.assertEqual(set(stats.get_stale_sections()), set(sections))
+
+    def assert_fresh(self, user):
+        self.assertFalse(UserStats.objects.get(user=user).is_stale())
+
+    def test_owners_clear(self):
+        self.game.owners.clear()
+        self.assert_marked(self.owner, UserStats.OWNED_GAME_SECTIONS)
+        self.assert_fresh(self.user)
+
+    def test_owned_games_clear(self):
+        self.owner.games.clear()
+        self.assert_marked(self.owner, UserStats.OWNED_GAME_SECTIONS)
+
+    def test_gamenight_games_clear(self):
+        self.gamenight.games.clear()
+        self.assert_marked(self.owner, UserStats.OWNED_GAME_SECTIONS)
+        self.assert_marked(self.user, UserStats.WEEKDAY_SECTIONS + UserStats.PLAY_SECTIONS)
+
+    def test_game_deleted(self):
+        self.game.delete()
+        self.assert_marked(self.owner, UserStats.OWNED_GAME_SECTIONS)
+        self.assert_marked(self.user, UserStats.WEEKDAY_SECTIONS + UserStats.PLAY_SECTIONS)
+
+    def test_feedback_deleted(self):
+        general = GeneralFeedback.objects.create(gamenight=self.gamenight, attendee=self.contact, overall_rating=4)
+        game_feedback = GameFeedback.objects.create(gamenight=self.gamenight, attendee=self.contact, game=self.game, rating=5)
+        for user in (self.user, self.owner):
+            UserStats.objects.refresh(user)
+        general.delete()
+        self.assert_marked(self.user, UserStats.WEEKDAY_SECTIONS)
+        UserStats.objects.refresh(self.user)
+        game_feedback.delete()
+        self.assert_marked(self.user, UserStats.RATING_SECTIONS)
+        self.assert_fresh(self.owner)
+
+    def test_attendees_clear(self):
+        self.gamenight.attendees.clear()
+        self.assert_marked(self.user, UserStats.WEEKDAY_SECTIONS + UserStats.PLAYER_SECTIONS)
+        self.assert_fresh(self.owner)
+
+
+class CollectionImportTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='host', email='host@example.com')
+        self.games = [Game.objects.create(title=f'Game {bgg}', bgg=bgg, pub_year=2000) for bgg in (1, 2, 3)]
+        self.games[0].owners.add(self.user)
+        self.games[1].wishlisted.add(self.user)
+
+    def run_import(self, wishlist):
+        job = CollectionImport.objects.create(user=self.user, bgg_ids=[1, 2, 3], wishlist=wishlist)
+        with mock.patch.object(refresh_user_stats, 'apply_async'):
+            with self.captureOnCommitCallbacks(execute=True):
+                return import_collection(job)
+
+    def test_owned_import_leaves_wishlist(self):
+        job = self.run_import(wishlist=False)
+        self.assertEqual(job.linked, 2)
+        self.assertEqual(set(self.user.games.values_list('bgg', flat=True)), {1, 2, 3})
+        self.assertFalse(self.user.wishlist.exists())
+
+    def test_wishlist_import_leaves_library(self):
+        job = self.run_import(wishlist=True)
+        self.assertEqual(job.linked, 2)
+        self.assertEqual(set(self.user.wishlist.values_list('bgg', flat=True)), {1, 2, 3})
+        self.assertFalse(self.user.games.exists())
+
+    def test_existing_games_count_as_fetched(self):
+        job = self.run_import(wishlist=False)
+        self.assertEqual((job.fetched, job.total, job.new_games), (3, 3, 0))
+
+    def test_running_job_is_resumed(self):
+        job = CollectionImport.objects.create(user=self.user, username='host', bgg_ids=[1, 2, 3], status='Running')
+        with mock.patch('api.importers.get_collection_ids') as get_collection_ids, \
+                mock.patch.object(refresh_user_stats, 'apply_async'), \
+                self.captureOnCommitCallbacks(execute=True):
+            import_collection_task(job.pk)
+        # the collection fetched by the interrupted run is reused
+        get_collection_ids.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Done')
+        self.assertEqual(set(self.user.games.values_list('bgg', flat=True)), {1, 2, 3})
+
+    def test_stalled_jobs_are_requeued(self):
+        stalled = CollectionImport.objects.create(user=self.user, bgg_ids=[1], status='Running')
+        recent = CollectionImport.objects.create(user=self.user, bgg_ids=[2])
+        done = CollectionImport.objects.create(user=self.user, bgg_ids=[3], status='Done')
+        timeout = timezone.now() - timedelta(seconds=settings.COLLECTION_IMPORT_TIMEOUT + 1)
+        CollectionImport.objects.filter(pk__in=[stalled.pk, done.pk]).update(updated_at=timeout)
+        with mock.patch.object(import_collection_task, 'apply_async') as apply_async:
+            self.assertEqual(resume_collection_imports(), 1)
+        apply_async.assert_called_once_with((stalled.pk,))
+        # not requeued again before another timeout passes
+        self.assertFalse(CollectionImport.objects.stalled().exists())
+        self.assertNotIn(recent, CollectionImport.objects.stalled())
+
+
+class CategoryIdsTests(TestCase):
+
+    def test_creates_missing(self):
+        dice = Category.objects.create(name='Dice')
+        category_ids = Category.objects.ids_for(['Dice', 'War', 'Dice'])
+        self.assertEqual(list(category_ids), ['Dice', 'War'])
+        self.assertEqual(category_ids['Dice'], dice.pk)
+        self.assertEqual(category_ids['War'], Category.objects.get(name='War').pk)
+
+    def test_concurrent_insert(self):
+        # another process adds the category after the map was loaded
+        with mock.patch.object(Category.objects, 'name_map', return_value={}):
+            Category.objects.create(name='Dice')
+            category_ids = Category.objects.ids_for(['Dice'])
+        self.assertEqual(Category.objects.filter(name='Dice').count(), 1)
+        self.assertEqual(category_ids, {'Dice': Category.objects.get(name='Dice').pk})
+
+
+class GameDetailViewTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='host', email='host@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch('api.importers.get_redis', return_value=fakeredis.FakeStrictRedis())
+        self.addCleanup(patcher.stop)
+        patcher.start()
+        patcher = mock.patch('api.bgg.get_client')
+        self.addCleanup(patcher.stop)
+        self.bgg_client = patcher.start().return_value
+        self.bgg_client.things.side_effect = lambda bgg_ids: b'<items>' + b''.join(thing_xml(bgg, f'Game {bgg}') for bgg in bgg_ids) + b'</items>'
+
+    def test_get_pending_then_done(self):
+        result = mock.Mock()
+        result.get.side_effect = CeleryTimeoutError()
+        with mock.patch('api.importers.start_game_import', return_value=result):
+            response = self.client.get('/games/13/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertTrue(response['Location'].endswith('/games/13/import/'))
+
+        # the import task finishes in the background
+        Game.objects.create(title='Catan', bgg=13, pub_year=1995)
+        self.assertEqual(self.client.get('/games/13/import/').data['status'], 'done')
+        response = self.client.get('/games/13/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Catan')
+
+    def test_failed_import_task(self):
+        result = mock.Mock()
+        result.get.side_effect = RuntimeError('worker lost')
+        with mock.patch('api.importers.start_game_import', return_value=result), self.assertLogs('api.importers', 'ERROR'):
+            response = self.client.get('/games/13/')
+        self.assertEqual(response.status_code, 502)
+
+    def test_update_imports_and_applies(self):
+        with mock.patch('api.importers.start_game_import') as start_game_import:
+            response = self.client.patch('/games/13/', {'owned': []}, format='json')
+            self.assertEqual(response.status_code, 200)
+            response = self.client.patch('/games/14/', {'wishlisted': []}, format='json')
+        start_game_import.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(self.user.games.values_list('bgg', flat=True)), [13])
+        self.assertEqual(list(self.user.wishlist.values_list('bgg', flat=True)), [14])
+        self.assertEqual(self.bgg_client.things.call_count, 2)
@@ -1,16 +1,24 @@
 from django.shortcuts import get_object_or_404
 from django.core.mail import send_mail
 from django.core.exceptions import BadRequest
-from rest_framework.generics import ListAPIView, RetrieveUpdateAPIView, ListCreateAPIView, CreateAPIView, RetrieveUpdateDestroyAPIView
-from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.exceptions import NotFound, APIException
+from rest_framework.views import APIView
+from rest_framework.generics import ListAPIView, RetrieveAPIView, RetrieveUpdateAPIView, ListCreateAPIView, CreateAPIView, RetrieveUpdateDestroyAPIView
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
 from .models import Game, GameNight, Tag, Category, Contact, Voting, GeneralFeedback, GameFeedback, RSVP
-from .serializers import GameListSerializer, GameNightSerializer, GameDetailSerializer, TagListSerializer, ContactSerializer, VotingSerializer, GameNightCreateSerializer, GeneralFeedbackSerializer, GameFeedbackSerializer, RSVPSerializer
+from .serializers import GameListSerializer, GameNightSerializer, GameDetailSerializer, TagListSerializer, ContactSerializer, VotingSerializer, GameNightCreateSerializer, GameNightSummarySerializer, GeneralFeedbackSerializer, GameFeedbackSerializer, RSVPSerializer, CollectionImportSerializer
 from .permissions import IsAuthorOrReadOnly
-import requests, json, xmltodict, decimal, string, random
+from .pagination import GameNightCursorPagination
+from .bgg import BGGError, BGGNotFound
+from .importers import GameImportPending, GameImportFailed, import_or_wait, current_game_import, new_game
+import string, random
 from datetime import date, datetime, timedelta
 from rest_framework import status
 from rest_framework.response import Response
-from .tasks import test_email
+from .tasks import test_email, import_collection, apply_on_commit
+from .mail import email_batch
 from celery.app.control import Control
 from celery.result import AsyncResult
 from api import serializers
@@ -22,7 +30,7 @@ class LibraryView(ListAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        queryset = user.games.all()
+        queryset = user.games.with_feedback(user).prefetch_related('categories')
         return queryset
 
 
@@ -32,10 +40,33 @@ class GameDetailView(RetrieveUpdateAPIView):
     lookup_field = 'bgg'
 
     def get_game(self, queryset, bgg):
-        if queryset.filter(bgg=bgg).exists():
-            return queryset.filter(bgg=bgg)[0]
-        else:
+        '''
+        Returns the game, importing it from BGG if it isn't stored yet. A GET
+        answers 202 while a slow import finishes in the background; updates
+        import the game in the request so the owned/wishlisted toggle is
+        applied to it.
+        '''
+        game = queryset.filter(bgg=bgg).first()
+        if game is not None:
+            return game
+        try:
+            if self.request.method in SAFE_METHODS:
+                return import_or_wait(bgg)
             return new_game(bgg)
+        except BGGNotFound:
+            raise NotFound(f"BGG has no game with ID {bgg}")
+        except BGGError:
+            raise BGGUnavailable()
+        except GameImportFailed:
+            raise GameImportError()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, GameImportPending):
+            poll_url = self.request.build_absolute_uri(reverse('game-import', args=[exc.bgg]))
+            data = {'bgg': exc.bgg, 'status': 'pending', 'poll': poll_url}
+            headers = {'Location': poll_url, 'Retry-After': '2'}
+            return Response(data, status=status.HTTP_202_ACCEPTED, headers=headers)
+        return super().handle_exception(exc)
 
     def get_object(self):
         queryset = self.filter_queryset(self.get_queryset())
@@ -77,75 +108,61 @@ class GameDetailView(RetrieveUpdateAPIView):
         game.save()
 
 
-def new_game(bgg):
-    '''
-    Takes a BGG ID and returns the associated game object using the BGG XML
-    API2, courtesy of Board Game Geek.
-    '''
+class BGGUnavailable(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = 'Board Game Geek is unavailable, try again later.'
+    default_code = 'bgg_unavailable'
 
-    url = f"https://www.boardgamegeek.com/xmlapi2/thing?id={bgg}&stats=1"
 
-    game_dict = xml_to_dict(url)
+class GameImportError(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = 'The game could not be imported, try again later.'
+    default_code = 'game_import_failed'
 
-    game_obj = create_game_obj(game_dict)
 
-    return game_obj
-
-def xml_to_dict(url):
-    response = requests.get(url)
-    ordered_dict = xmltodict.parse(response.text)
-    game_dict_nest = json.loads(json.dumps(ordered_dict))
-    game_dict = game_dict_nest['items']['item']
-    return game_dict
-
-def get_primary_name(names_list):
+class GameImportView(APIView):
     '''
-    Returns the English name of the specified board game
+    Reports the progress of a game import started by GameDetailView.
     '''
 
-    if isinstance(names_list, dict):
-        return names_list['@value']
+    def get(self, request, bgg):
+        detail_url = request.build_absolute_uri(reverse('game-detail', args=[bgg]))
+        if Game.objects.filter(bgg=bgg).exists():
+            return Response({'bgg': bgg, 'status': 'done', 'game': detail_url})
+        result = current_game_import(bgg)
+        if result is None:
+            return Response({'bgg': bgg, 'status': 'missing', 'game': detail_url}, status=status.HTTP_404_NOT_FOUND)
+        if result.failed():
+            return Response({'bgg': bgg, 'status': 'failed', 'game': detail_url})
+        return Response({'bgg': bgg, 'status': 'pending', 'game': detail_url})
 
-    for name in names_list:
-        if name['@type'] == 'primary':
-            return name['@value']
 
-def create_game_obj(game_dict):
+class CollectionImportView(CreateAPIView):
     '''
-    Creates an instance of the Game class using data from the given dictionary.
+    Starts importing a BGG collection (or a list of BGG IDs) into the user's
+    library or wishlist. The import runs in Celery; poll the returned job.
     '''
 
-    names = game_dict['name']
-    link_dict = game_dict['link']
-
-    game_obj = Game(
-        title=get_primary_name(names),
-        bgg=int(game_dict['@id']),
-        image=game_dict['image'],
-        pub_year=int(game_dict['yearpublished']['@value']),
-        min_players=int(game_dict['minplayers']['@value']),
-        max_players=int(game_dict['maxplayers']['@value']),
-        playtime=int(game_dict['playingtime']['@value']),
-        player_age=int(game_dict['minage']['@value']),
-        weight=decimal.Decimal(game_dict['statistics']['ratings']['averageweight']['@value'])
-    )
-
-    game_obj.save()
+    serializer_class = CollectionImportSerializer
+    permission_classes = [IsAuthenticated]
 
-    game_obj.categories.set(get_categories(link_dict))
+    def perform_create(self, serializer):
+        job = serializer.save(user=self.request.user)
+        apply_on_commit(import_collection, (job.pk,))
 
-    return game_obj
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        response['Location'] = request.build_absolute_uri(reverse('collection-import-detail', args=[response.data['pk']]))
+        return response
 
-def get_categories(link_dict):
-    categories = []
 
-    for item in link_dict:
-        if item['@type'] == 'boardgamecategory':
-            name = item['@value']
-            category = Category.objects.get(name=name)
-            categories.append(category)
+class CollectionImportDetailView(RetrieveAPIView):
+    serializer_class = CollectionImportSerializer
+    permission_classes = [IsAuthenticated]
 
-    return categories
+    def get_queryset(self):
+        return self.request.user.collection_imports.all()
 
 
 class WishListView(ListAPIView):
@@ -153,20 +170,23 @@ class WishListView(ListAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        queryset = user.wishlist.all()
+        queryset = user.wishlist.with_feedback(user).prefetch_related('categories')
         return queryset
 
 
 class GameNightView(ListCreateAPIView):
     # queryset = GameNight.objects.all()
-    serializer_class = GameNightSerializer
+    serializer_class = GameNightSummarySerializer
+    pagination_class = GameNightCursorPagination
     # permission_classes = [IsAuthorOrReadOnly]
 
     def get_queryset(self):
         user = self.request.user
-        queryset = user.gamenights.all()
+        queryset = user.gamenights.with_counts()
         return queryset
 
+    @transaction.atomic
+    @email_batch()
     def perform_create(self, serializer):
         rand_id = self.get_rid()
         serializer.save(user=self.request.user, rid=rand_id)
@@ -201,7 +221,7 @@ class TagListView(ListCreateAPIView):
 
 
 class GameNightDetailView(RetrieveUpdateAPIView):
-    queryset = GameNight.objects.all()
+    queryset = GameNight.objects.with_related()
     serializer_class = GameNightSerializer
     permission_classes = [IsAuthorOrReadOnly]
 
@@ -221,6 +241,8 @@ class GameNightDetailView(RetrieveUpdateAPIView):
         self.check_object_permissions(self.request, obj)
         return obj
 
+    @transaction.atomic
+    @email_batch()
     def perform_update(self, serializer):
         gamenight = self.get_object()
         data = self.request.data
@@ -257,10 +279,10 @@ class GameNightDetailView(RetrieveUpdateAPIView):
             gn_status = gamenight.status
             if data['status'] == 'Finalized' or gn_status == 'Finalized':
                 if data['status'] != gn_status:
-                    updated_gamenight.update_feedback_task()
+                    updated_gamenight.update_feedback()
         if 'date' in data:
             if data['date'] != str(gamenight.date):
-                updated_gamenight.update_feedback_task()
+                updated_gamenight.update_feedback()
 
 
 
@@ -269,7 +291,7 @@ class ContactListView(ListCreateAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        queryset = Contact.objects.filter(user_id=user.id)
+        queryset = Contact.objects.filter(user_id=user.id).with_attendance()
         return queryset
 
     def perform_create(self, serializer):
@@ -312,7 +334,7 @@ class ContactUpdateView(RetrieveUpdateDestroyAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        queryset = Contact.objects.filter(user_id=user.id)
+        queryset = Contact.objects.filter(user_id=user.id).with_attendance()
         return queryset
 
 
@@ -403,6 +425,8 @@ class RSVPListCreateView(ListCreateAPIView):
         queryset = gamenight.rsvps.all()
         return queryset
 
+    @transaction.atomic
+    @email_batch()
     def perform_create(self, serializer):
         gamenight_rid = self.kwargs['rid']
         gamenight = get_object_or_404(GameNight, rid=gamenight_rid)
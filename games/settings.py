@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import environ
 import django_on_heroku
@@ -179,8 +180,96 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 
 # CELERY STUFF
-BROKER_URL = env('REDIS_URL')
-CELERY_RESULT_BACKEND = env('REDIS_URL')
+REDIS_URL = env('REDIS_URL')
+BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+CELERYBEAT_SCHEDULE = {
+    'refresh-stale-games': {
+        'task': 'api.tasks.refresh_stale_games',
+        'schedule': timedelta(seconds=env.int('GAME_REFRESH_INTERVAL', default=60 * 60)),
+    },
+    'send-due-feedback': {
+        'task': 'api.tasks.send_due_feedback',
+        'schedule': timedelta(seconds=env.int('FEEDBACK_SWEEP_INTERVAL', default=5 * 60)),
+    },
+    'send-due-reminders': {
+        'task': 'api.tasks.send_due_reminders',
+        'schedule': timedelta(seconds=env.int('REMINDER_SWEEP_INTERVAL', default=5 * 60)),
+    },
+    # catches retries and anything a missed wake-up left behind
+    'drain-outbox': {
+        'task': 'api.tasks.drain_outbox',
+        'schedule': timedelta(seconds=env.int('OUTBOX_DRAIN_INTERVAL', default=60)),
+    },
+    'prune-outbox': {
+        'task': 'api.tasks.prune_outbox',
+        'schedule': timedelta(seconds=env.int('OUTBOX_PRUNE_INTERVAL', default=60 * 60 * 24)),
+    },
+    'resume-collection-imports': {
+        'task': 'api.tasks.resume_collection_imports',
+        'schedule': timedelta(seconds=env.int('COLLECTION_IMPORT_SWEEP_INTERVAL', default=5 * 60)),
+    },
+    # stats whose refresh task was lost
+    'refresh-stale-user-stats': {
+        'task': 'api.tasks.refresh_stale_user_stats',
+        'schedule': timedelta(seconds=env.int('USER_STATS_SWEEP_INTERVAL', default=5 * 60)),
+    },
+    # invites whose debounced flush task was lost
+    'flush-due-invites': {
+        'task': 'api.tasks.flush_due_invite_notifications',
+        'schedule': timedelta(seconds=env.int('INVITE_SWEEP_INTERVAL', default=5 * 60)),
+    },
+}
+
+# BGG XML API settings
+BGG_BASE_URL = env('BGG_BASE_URL', default='https://boardgamegeek.com')
+BGG_CONNECT_TIMEOUT = env.float('BGG_CONNECT_TIMEOUT', default=3.05)
+BGG_READ_TIMEOUT = env.float('BGG_READ_TIMEOUT', default=20)
+BGG_MAX_RETRIES = env.int('BGG_MAX_RETRIES', default=4)
+# collections stay queued (202) for longer, 7 retries back off for about two minutes
+BGG_COLLECTION_MAX_RETRIES = env.int('BGG_COLLECTION_MAX_RETRIES', default=7)
+BGG_RETRY_BACKOFF = env.float('BGG_RETRY_BACKOFF', default=1.0)
+# longest single wait between retries, Retry-After included
+BGG_MAX_RETRY_DELAY = env.float('BGG_MAX_RETRY_DELAY', default=60)
+BGG_POOL_SIZE = env.int('BGG_POOL_SIZE', default=4)
+BGG_BATCH_SIZE = env.int('BGG_BATCH_SIZE', default=20)
+BGG_BACKFILL_CHECKPOINT = env('BGG_BACKFILL_CHECKPOINT', default=str(BASE_DIR / '.bgg_backfill_checkpoint'))
+BGG_CACHE_TTL = env.int('BGG_CACHE_TTL', default=60 * 60 * 24 * 14)
+# requests per second shared by all processes (0 disables the limiter)
+BGG_RATE_LIMIT = env.float('BGG_RATE_LIMIT', default=1.0)
+BGG_RATE_BURST = env.int('BGG_RATE_BURST', default=5)
+BGG_RATE_MAX_WAIT = env.float('BGG_RATE_MAX_WAIT', default=30)
+
+# Game imports on a GameDetailView miss
+GAME_IMPORT_WAIT = env.float('GAME_IMPORT_WAIT', default=3.0)
+GAME_IMPORT_TTL = env.int('GAME_IMPORT_TTL', default=300)
+
+# seconds without progress before a collection import is resumed
+COLLECTION_IMPORT_TIMEOUT = env.int('COLLECTION_IMPORT_TIMEOUT', default=15 * 60)
+
+# Game metadata refresher, games re-fetched from BGG per scheduled run
+GAME_REFRESH_BUDGET = env.int('GAME_REFRESH_BUDGET', default=100)
+
+# seconds without invitee changes before new invitees of a gamenight are mailed
+INVITE_DEBOUNCE = env.int('INVITE_DEBOUNCE', default=60)
+
+# Email outbox
+OUTBOX_BATCH_SIZE = env.int('OUTBOX_BATCH_SIZE', default=50)
+OUTBOX_MAX_ATTEMPTS = env.int('OUTBOX_MAX_ATTEMPTS', default=8)
+OUTBOX_RETRY_BACKOFF = env.int('OUTBOX_RETRY_BACKOFF', default=30)
+OUTBOX_MAX_RETRY_DELAY = env.int('OUTBOX_MAX_RETRY_DELAY', default=60 * 60)
+# seconds a claimed email stays with its worker before another one may retry it
+OUTBOX_LEASE = env.int('OUTBOX_LEASE', default=5 * 60)
+# seconds sent emails are kept before prune_outbox deletes them
+OUTBOX_RETENTION = env.int('OUTBOX_RETENTION', default=60 * 60 * 24 * 30)
+
+# Dashboard stats: seconds a stale payload may be served before it is rebuilt
+# in the request, and stale rows rebuilt per scheduled sweep
+USER_STATS_MAX_STALENESS = env.int('USER_STATS_MAX_STALENESS', default=15 * 60)
+USER_STATS_SWEEP_BUDGET = env.int('USER_STATS_SWEEP_BUDGET', default=100)
+
+# hours before a finalized gamenight starts that attendees get a reminder
+REMINDER_HOURS = env.int('REMINDER_HOURS', default=24)
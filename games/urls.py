@@ -23,7 +23,10 @@ urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
     path('api-auth/', include('rest_framework.urls')),
     path('library/', views.LibraryView.as_view(), name='user-library'),
+    path('library/import/', views.CollectionImportView.as_view(), name='collection-import'),
+    path('library/import/<int:pk>/', views.CollectionImportDetailView.as_view(), name='collection-import-detail'),
     path('games/<int:bgg>/', views.GameDetailView.as_view(), name='game-detail'),
+    path('games/<int:bgg>/import/', views.GameImportView.as_view(), name='game-import'),
     path('wishlist/', views.WishListView.as_view(), name='user-wishlist'),
     path('gamenight/', views.GameNightView.as_view(), name='game-night'),
     path('gamenight/<str:rid>/', views.GameNightDetailView.as_view(), name='game-night-detail'),